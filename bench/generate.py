@@ -0,0 +1,134 @@
+from urllib.parse import quote_plus
+import random
+import math
+
+syllables = (
+    "ka", "ri", "mo", "ter", "gan", "lo", "vin", "dra", "sch", "ul",
+    "mar", "ek", "tor", "bel", "fin", "zu", "rak", "ost", "wen", "ä"
+)
+
+# kill file name -> ranked entity
+kill_files = {
+    'kill_att.txt': "player",
+    'kill_def.txt': "player",
+    'kill_sup.txt': "player",
+    'kill_all.txt': "player",
+    'kill_att_tribe.txt': "tribe",
+    'kill_def_tribe.txt': "tribe",
+    'kill_all_tribe.txt': "tribe"
+}
+
+config_xml = '<?xml version="1.0" encoding="UTF-8" ?><config>' \
+             '<speed>{speed}</speed><unit_speed>{unit_speed}</unit_speed><moral>1</moral>' \
+             '<game><archer>1</archer><knight>1</knight><tech>2</tech></game>' \
+             '<snob><gold>1</gold><max_dist>70</max_dist></snob></config>'
+
+
+def random_name(rng, parts=3):
+    name = "".join(rng.choice(syllables) for _ in range(rng.randint(2, parts)))
+
+    if rng.random() < .2:
+        name += " " + rng.choice(syllables).upper()
+
+    # inno encodes names like php's urlencode
+    return quote_plus(name.capitalize())
+
+
+def ranked(scores):
+    """returns (rank, id, score) lines ordered by score"""
+    order = sorted(scores.items(), key=lambda item: item[1], reverse=True)
+    return [f"{rank},{id_},{score}" for rank, (id_, score) in enumerate(order, start=1)]
+
+
+def generate_world(world, villages=50000, seed=0):
+    """returns file name -> content of a deterministic world with given village count"""
+    rng = random.Random(f"{world}:{villages}:{seed}")
+    player_count = max(villages // 8, 1)
+    tribe_count = max(player_count // 40, 1)
+
+    tribe_ids = sorted(rng.sample(range(1, tribe_count * 20 + 1), tribe_count))
+    player_ids = sorted(rng.sample(range(1000, player_count * 50 + 1000), player_count))
+    player_tribes = {pid: rng.choice(tribe_ids) if rng.random() < .7 else 0 for pid in player_ids}
+
+    # few big players own most of the map like on real worlds
+    weights = [rng.paretovariate(1.2) for _ in player_ids]
+    owners = rng.choices(player_ids, weights=weights, k=villages)
+
+    player_villages = dict.fromkeys(player_ids, 0)
+    player_points = dict.fromkeys(player_ids, 0)
+    village_lines = []
+
+    for village_id, owner in enumerate(owners, start=1):
+        # villages spiral out of the map center
+        radius = math.sqrt(village_id / villages) * 450 + rng.uniform(-10, 10)
+        angle = rng.uniform(0, 2 * math.pi)
+        x = min(max(int(500 + radius * math.cos(angle)), 0), 999)
+        y = min(max(int(500 + radius * math.sin(angle)), 0), 999)
+
+        if rng.random() < .25:
+            owner, points = 0, rng.randint(26, 3000)
+        else:
+            points = rng.randint(300, 12154)
+            player_villages[owner] += 1
+            player_points[owner] += points
+
+        village_lines.append([village_id, random_name(rng), x, y, owner, points])
+
+    for rank, line in enumerate(sorted(village_lines, key=lambda l: l[5], reverse=True), start=1):
+        line.append(rank)
+
+    village_lines.sort(key=lambda l: l[0])
+    player_rank = {pid: rank for rank, pid in enumerate(
+        sorted(player_ids, key=player_points.get, reverse=True), start=1)}
+
+    player_lines = [
+        f"{pid},{random_name(rng)},{player_tribes[pid]},{player_villages[pid]},{player_points[pid]},{player_rank[pid]}"
+        for pid in player_ids
+    ]
+
+    tribe_players = {tid: [] for tid in tribe_ids}
+    tribe_villages = dict.fromkeys(tribe_ids, 0)
+    tribe_points = dict.fromkeys(tribe_ids, 0)
+
+    for pid, tribe_id in player_tribes.items():
+        if tribe_id:
+            tribe_players[tribe_id].append(player_points[pid])
+            tribe_villages[tribe_id] += player_villages[pid]
+            tribe_points[tribe_id] += player_points[pid]
+
+    tribe_rank = {tid: rank for rank, tid in enumerate(
+        sorted(tribe_ids, key=tribe_points.get, reverse=True), start=1)}
+
+    tribe_lines = []
+    for tid in tribe_ids:
+        # points only count the best 40 members, all points everyone
+        top = sorted(tribe_players[tid], reverse=True)[:40]
+        tag = quote_plus("".join(rng.choice(syllables) for _ in range(2)).upper()[:6])
+        tribe_lines.append(
+            f"{tid},{random_name(rng, 4)},{tag},{len(tribe_players[tid])},"
+            f"{tribe_villages[tid]},{sum(top)},{tribe_points[tid]},{tribe_rank[tid]}"
+        )
+
+    files = {
+        'village.txt': "\n".join(",".join(map(str, line)) for line in village_lines) + "\n",
+        'player.txt': "\n".join(player_lines) + "\n",
+        'ally.txt': "\n".join(tribe_lines) + "\n"
+    }
+
+    for file_name, entity in kill_files.items():
+        ids = player_ids if entity == "player" else tribe_ids
+        active = [id_ for id_ in ids if rng.random() < .6]
+        scores = {id_: int(rng.paretovariate(1.1) * 1000) for id_ in active}
+        files[file_name] = "\n".join(ranked(scores)) + "\n"
+
+    return files
+
+
+def generate_servers(worlds, domain):
+    """php serialized world list like get_servers.php"""
+    entries = "".join(f's:{len(w)}:"{w}";s:{len(domain) + len(w) + 9}:"https://{w}.{domain}";' for w in worlds)
+    return f"a:{len(worlds)}:{{{entries}}}"
+
+
+def generate_config(speed=1, unit_speed=1):
+    return config_xml.format(speed=speed, unit_speed=unit_speed)
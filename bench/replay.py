@@ -0,0 +1,248 @@
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from bench.generate import generate_world, generate_servers, generate_config
+from urllib.parse import urlsplit
+from collections import Counter
+import threading
+import argparse
+import random
+import time
+import os
+
+maintenance_page = b'<!DOCTYPE html><html><head><title>Maintenance</title></head>' \
+                   b'<body>The game is currently being updated.</body></html>'
+
+# paths below a world, recorded under <domain>/<world>/<path>
+world_paths = (
+    "map/village.txt",
+    "map/player.txt",
+    "map/ally.txt",
+    "map/kill_att.txt",
+    "map/kill_def.txt",
+    "map/kill_sup.txt",
+    "map/kill_all.txt",
+    "map/kill_att_tribe.txt",
+    "map/kill_def_tribe.txt",
+    "map/kill_all_tribe.txt",
+    "interface.php"
+)
+
+
+class Faults:
+    """probabilities and latency of injected failures"""
+
+    def __init__(self, latency=0., jitter=0., error=0., html=0., partial=0., truncate=0., seed=0):
+        self.latency = latency
+        self.jitter = jitter
+        self.error = error
+        self.html = html
+        self.partial = partial
+        self.truncate = truncate
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+
+    def pick(self):
+        """returns the delay and the fault of one response"""
+        with self.lock:
+            delay = max(self.latency + self.random.uniform(-self.jitter, self.jitter), 0)
+            roll = self.random.random()
+
+        for fault in ("error", "html", "partial", "truncate"):
+            chance = getattr(self, fault)
+            if roll < chance:
+                return delay, fault
+
+            roll -= chance
+
+        return delay, None
+
+
+class ReplayServer:
+    """serves recorded or generated innogames endpoints under /<domain>/..."""
+
+    def __init__(self, files, faults=None, host="127.0.0.1", port=0):
+        self.files = files
+        self.faults = faults or Faults()
+        self.stats = Counter()
+        # handler threads count concurrently
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer((host, port), self.handler())
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def count(self, name, amount=1):
+        with self.lock:
+            self.stats[name] += amount
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    @property
+    def world_url(self):
+        # formatted by the updater with world and domain
+        return self.url + "/{1}/{0}"
+
+    @property
+    def server_url(self):
+        return self.url + "/{}"
+
+    @classmethod
+    def from_directory(cls, path, **kwargs):
+        files = {}
+        for root, _, names in os.walk(path):
+            for name in names:
+                full_path = os.path.join(root, name)
+                key = "/" + os.path.relpath(full_path, path).replace(os.sep, "/")
+
+                with open(full_path, "rb") as file:
+                    files[key] = file.read()
+
+        return cls(files, **kwargs)
+
+    @classmethod
+    def generated(cls, language, domain, worlds, villages, seed=0, **kwargs):
+        names = [f"{language}{index}" for index in range(1, worlds + 1)]
+        files = {f"/{domain}/backend/get_servers.php": generate_servers(names, domain).encode()}
+
+        for world in names:
+            files[f"/{domain}/{world}/interface.php"] = generate_config().encode()
+
+            for name, content in generate_world(world, villages, seed).items():
+                files[f"/{domain}/{world}/map/{name}"] = content.encode()
+
+        return cls(files, **kwargs)
+
+    def handler(self):
+        replay = self
+
+        class Handler(BaseHTTPRequestHandler):
+            # closing connections makes partial bodies visible to the client
+            protocol_version = "HTTP/1.0"
+
+            def do_GET(self):  # noqa
+                path = urlsplit(self.path).path
+                body = replay.files.get(path)
+                delay, fault = replay.faults.pick()
+                replay.count("requests")
+
+                if delay:
+                    time.sleep(delay)
+
+                if body is None:
+                    replay.count("missing")
+                    self.send_error(404)
+                    return
+
+                if fault is not None:
+                    replay.count(fault)
+
+                if fault == "error":
+                    self.send_error(503)
+                    return
+
+                elif fault == "html":
+                    body = maintenance_page
+
+                elif fault == "truncate":
+                    body = body[:len(body) // 2]
+
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; charset=utf-8")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+
+                # announces the full length but stops halfway
+                if fault == "partial":
+                    body = body[:len(body) // 2]
+
+                self.wfile.write(body)
+                replay.count("bytes", len(body))
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *args):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def record(path, worlds, languages, transport=None):
+    """stores the live endpoints of given worlds so they can be replayed"""
+    from utils.transport import HttpTransport
+    transport = transport or HttpTransport()
+
+    def store(key, url):
+        response = transport.get(url)
+        response.raise_for_status()
+
+        file_path = os.path.join(path, *key.strip("/").split("/"))
+        os.makedirs(os.path.dirname(file_path), exist_ok=True)
+
+        with open(file_path, "wb") as file:
+            file.write(response.content)
+
+    for domain in {languages[world[:2]] for world in worlds}:
+        store(f"/{domain}/backend/get_servers.php", f"https://{domain}/backend/get_servers.php")
+
+    for world in worlds:
+        domain = languages[world[:2]]
+
+        for world_path in world_paths:
+            query = "?func=get_config" if world_path == "interface.php" else ""
+            store(f"/{domain}/{world}/{world_path}", f"https://{world}.{domain}/{world_path}{query}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="replays innogames map endpoints with injectable failures")
+    parser.add_argument("--directory", help="serves a recording instead of generated worlds")
+    parser.add_argument("--record", nargs="+", metavar="WORLD", help="records given live worlds into --directory")
+    parser.add_argument("--language", default="zz")
+    parser.add_argument("--domain", default="bench")
+    parser.add_argument("--worlds", type=int, default=4)
+    parser.add_argument("--villages", type=int, default=50000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0., help="seconds per response")
+    parser.add_argument("--jitter", type=float, default=0.)
+    parser.add_argument("--error", type=float, default=0., help="share of 503 answers")
+    parser.add_argument("--html", type=float, default=0., help="share of maintenance pages")
+    parser.add_argument("--partial", type=float, default=0., help="share of bodies cut below their length")
+    parser.add_argument("--truncate", type=float, default=0., help="share of bodies truncated in half")
+    args = parser.parse_args()
+
+    if args.record:
+        if not args.directory:
+            parser.error("--record needs --directory")
+
+        # the updater owns the language -> domain mapping
+        from update import Cardinal
+        record(args.directory, args.record, Cardinal.languages)
+        return
+
+    faults = Faults(args.latency, args.jitter, args.error, args.html, args.partial, args.truncate, args.seed)
+    kwargs = {'faults': faults, 'host': args.host, 'port': args.port}
+
+    if args.directory:
+        replay = ReplayServer.from_directory(args.directory, **kwargs)
+    else:
+        replay = ReplayServer.generated(args.language, args.domain, args.worlds, args.villages, args.seed, **kwargs)
+
+    with replay:
+        print(f"Replaying {len(replay.files)} files, run the updater with "
+              f"--world-url '{replay.world_url}' --server-url '{replay.server_url}'")
+
+        try:
+            replay.thread.join()
+        except KeyboardInterrupt:
+            print(dict(replay.stats))
+
+
+if __name__ == "__main__":
+    main()
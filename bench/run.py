@@ -0,0 +1,340 @@
+from bench.replay import ReplayServer
+from contextlib import contextmanager
+from update import Cardinal
+from utils import config
+import tracemalloc
+import argparse
+import asyncio
+import json
+import time
+import os
+
+baseline_path = os.path.join(os.path.dirname(__file__), "baselines")
+local_hosts = (None, "", "localhost", "127.0.0.1", "::1")
+
+# endpoints measured per world, {} gets replaced with the world
+endpoint_paths = (
+    ("village", "/village/{}", ""),
+    ("player", "/player/{}", ""),
+    ("tribe", "/tribe/{}", ""),
+    ("player.top", "/player/{}/top/points", "amount=100"),
+    ("tribe.top", "/tribe/{}/top/all_bash", "amount=100"),
+    ("player.by_id", "/player/{}/by-id/{}", ""),
+)
+
+
+def percentile(values, share):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(share * (len(ordered) - 1))))]
+
+
+class Run:
+    __slots__ = ('rows', 'bytes')
+
+    def __init__(self):
+        self.rows = 0
+        self.bytes = 0
+
+
+class Stage:
+    """collects latencies, processed rows and peak python memory of one hot path
+
+    tracemalloc slows allocations down several times, so timings come from an untraced pass
+    and the peak from a separate traced one
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.latencies = []
+        self.rows = 0
+        self.bytes = 0
+        self.peak = 0
+        self.memory = False
+        self.tracing = False
+
+    def __enter__(self):
+        # nested stages share the outer trace
+        if self.memory and not tracemalloc.is_tracing():
+            self.tracing = True
+            tracemalloc.start()
+
+        return self
+
+    def __exit__(self, *args):
+        if self.memory:
+            self.peak = max(self.peak, tracemalloc.get_traced_memory()[1])
+
+        if self.tracing:
+            self.tracing = False
+            tracemalloc.stop()
+
+    @contextmanager
+    def measure(self):
+        run = Run()
+
+        if self.memory:
+            yield run
+            return
+
+        start = time.perf_counter()
+        yield run
+        self.latencies.append(time.perf_counter() - start)
+        self.rows += run.rows
+        self.bytes += run.bytes
+
+    def report(self):
+        total = sum(self.latencies) or 1e-9
+        return {
+            'runs': len(self.latencies),
+            'rows_per_second': round(self.rows / total, 1),
+            'mb_per_second': round(self.bytes / total / 2 ** 20, 2),
+            'p50_ms': round(percentile(self.latencies, .5) * 1000, 3),
+            'p95_ms': round(percentile(self.latencies, .95) * 1000, 3),
+            'p99_ms': round(percentile(self.latencies, .99) * 1000, 3),
+            'peak_mb': round(self.peak / 2 ** 20, 2)
+        }
+
+
+class Bench:
+    def __init__(self, args):
+        self.args = args
+        self.worlds = [f"zz{index}" for index in range(1, args.worlds + 1)]
+        self.domain = "bench"
+        self.results = {}
+        self.cardinal = None
+        # timed pass first, then one traced pass for the peak memory
+        self.memory = False
+        self.repeat = args.repeat
+
+    def prepare(self, replay):
+        cardinal = self.cardinal = Cardinal(replay.world_url, replay.server_url)
+        cardinal.languages = {'zz': self.domain}
+        cardinal.worlds = self.worlds
+        cardinal.cursor = cardinal.conn.cursor()
+        cardinal.setup_tables()
+        cur = cardinal.conn.cursor()
+
+        for world in self.worlds:
+            for table in (*cardinal.types[:-1], *cardinal.summaries):
+                cur.execute(f'CREATE TABLE IF NOT EXISTS {table}_{world} '
+                            f'PARTITION OF {table} FOR VALUES IN (\'{world}\');')
+
+            query = 'INSERT INTO world (world, speed, unit_speed, moral, config) ' \
+                    'VALUES (%s, 1, 1, 1, %s) ON CONFLICT (world) DO NOTHING'
+            cur.execute(query, (world, json.dumps({'game': {'archer': "1", 'knight': "1"}})))
+
+        cardinal.conn.commit()
+
+    def teardown(self):
+        cur = self.cardinal.conn.cursor()
+        for world in self.worlds:
+            self.cardinal.cleanup_dead_world(cur, world)
+
+        self.cardinal.conn.commit()
+
+    def stage(self, name):
+        stage = self.results.setdefault(name, Stage(name))
+        stage.memory = self.memory
+        return stage
+
+    def bench_packer(self):
+        for table in self.cardinal.types[:-1]:
+            with self.stage(f"data_packer.{table}") as stage:
+                for _ in range(self.repeat):
+                    for world in self.worlds:
+                        with stage.measure() as run:
+                            run.rows = len(self.cardinal.data_packer(table, world))
+
+    def bench_update(self):
+        with self.stage("update_data") as stage:
+            for _ in range(self.repeat):
+                with stage.measure():
+                    self.cardinal.update_data()
+
+                # rows only count next to their timings
+                if stage.memory:
+                    continue
+
+                cur = self.cardinal.conn.cursor()
+                for world in self.worlds:
+                    for table in self.cardinal.types[:-1]:
+                        cur.execute(f'SELECT count(*) FROM {table}_{world}')
+                        stage.rows += cur.fetchone()[0]
+
+    async def bench_api(self):
+        # imported late so the updater stages run without the api stack
+        import endpoint
+        from utils import parse_result
+
+        endpoint.limiter.enabled = False
+        endpoint.initiate_errors(endpoint.app)
+        db = endpoint.db
+        await db.connect()
+
+        try:
+            with self.stage("Database.fetch.full") as fetch_stage, self.stage("parse_result") as parse_stage:
+                for _ in range(self.repeat):
+                    for world in self.worlds:
+                        query = db.create_query('village', 'SELECT * FROM {}', world)
+
+                        with fetch_stage.measure() as run:
+                            response = await db.fetch(query, key='id')
+                            run.rows = len(response)
+
+                        with parse_stage.measure() as run:
+                            parse_result(response, 'name', iterable=True)
+                            run.rows = len(response)
+
+            with self.stage("Database.fetchone") as stage:
+                for world in self.worlds:
+                    query = db.create_query('player', 'SELECT * FROM {} WHERE id = $1', world)
+                    ids = [row['id'] for row in await db.fetch(
+                        db.create_query('player', 'SELECT id FROM {} LIMIT 200', world))]
+
+                    for _ in range(self.repeat):
+                        for player_id in ids:
+                            with stage.measure() as run:
+                                await db.fetchone(query, player_id)
+                                run.rows = 1
+
+            for name, path, query_string in endpoint_paths:
+                with self.stage(f"endpoint.{name}") as stage:
+                    for world in self.worlds:
+                        player = await db.fetchone(db.create_query('player', 'SELECT id FROM {} LIMIT 1', world))
+                        url = path.format(world, player['id'] if player else 0)
+
+                        for _ in range(self.repeat):
+                            with stage.measure() as run:
+                                status, size = await asgi_get(endpoint.app, url, query_string)
+                                run.rows, run.bytes = 1, size
+
+                            if status != 200:
+                                raise RuntimeError(f"{url} answered with {status}")
+        finally:
+            await db.disconnect()
+
+    def run_stages(self, stages):
+        if "packer" in stages:
+            self.bench_packer()
+
+        if "update" in stages or "api" in stages:
+            self.bench_update()
+
+        if "api" in stages:
+            asyncio.run(self.bench_api())
+
+    def run(self):
+        stages = self.args.stages.split(",")
+
+        replay = ReplayServer.generated('zz', self.domain, len(self.worlds), self.args.villages, self.args.seed)
+
+        with replay:
+            self.prepare(replay)
+
+            try:
+                self.run_stages(stages)
+
+                self.memory, self.repeat = True, 1
+                self.run_stages(stages)
+            finally:
+                if not self.args.keep:
+                    self.teardown()
+
+        return {name: stage.report() for name, stage in self.results.items()}
+
+
+async def asgi_get(app, path, query_string=""):
+    """calls the asgi app in process and returns status and body size"""
+    scope = {
+        'type': "http",
+        'asgi': {'version': "3.0"},
+        'http_version': "1.1",
+        'method': "GET",
+        'scheme': "http",
+        'path': path,
+        'raw_path': path.encode(),
+        'root_path': "",
+        'query_string': query_string.encode(),
+        'headers': [(b"host", b"bench")],
+        'client': ("127.0.0.1", 0),
+        'server': ("bench", 80)
+    }
+
+    response = {'status': None, 'size': 0}
+
+    async def receive():
+        return {'type': "http.request", 'body': b"", 'more_body': False}
+
+    async def send(message):
+        if message['type'] == "http.response.start":
+            response['status'] = message['status']
+        elif message['type'] == "http.response.body":
+            response['size'] += len(message.get('body', b""))
+
+    await app(scope, receive, send)
+    return response['status'], response['size']
+
+
+def compare(report, baseline, threshold):
+    """prints changes against a stored baseline, returns True on regressions"""
+    regression = False
+
+    for name, current in report.items():
+        previous = baseline.get(name)
+        if previous is None:
+            print(f"{name:<28} no baseline")
+            continue
+
+        # higher is better for throughput, lower for everything else
+        for key, higher_is_better in (('rows_per_second', True), ('p95_ms', False), ('peak_mb', False)):
+            old, new = previous.get(key), current[key]
+            if not old:
+                continue
+
+            change = (new - old) / old
+            worse = -change if higher_is_better else change
+            flag = "REGRESSION" if worse > threshold else ""
+            regression |= bool(flag)
+            print(f"{name:<28} {key:<16} {old:>12} -> {new:>12} ({change:+.1%}) {flag}")
+
+    return regression
+
+
+def main():
+    parser = argparse.ArgumentParser(description="offline benchmark of the updater and api hot paths")
+    parser.add_argument("--worlds", type=int, default=2)
+    parser.add_argument("--villages", type=int, default=50000)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--stages", default="packer,update,api")
+    parser.add_argument("--save", help="stores the report as named baseline")
+    parser.add_argument("--compare", help="compares against named baseline")
+    parser.add_argument("--threshold", type=float, default=.1)
+    parser.add_argument("--keep", action="store_true", help="keeps the generated worlds in the database")
+    parser.add_argument("--force", action="store_true", help="allows non local database hosts")
+    args = parser.parse_args()
+
+    # the bench truncates tables and recreates the cache table
+    if config.conn_kwargs.get('host') not in local_hosts and not args.force:
+        parser.error("database host is not local, use --force if you really mean it")
+
+    report = Bench(args).run()
+
+    for name, result in report.items():
+        print(f"{name:<28} " + " ".join(f"{key}={value}" for key, value in result.items()))
+
+    if args.save:
+        os.makedirs(baseline_path, exist_ok=True)
+        with open(os.path.join(baseline_path, f"{args.save}.json"), "w") as file:
+            json.dump({'args': vars(args), 'stages': report}, file, indent=2)
+
+    if args.compare:
+        with open(os.path.join(baseline_path, f"{args.compare}.json")) as file:
+            baseline = json.load(file)['stages']
+
+        if compare(report, baseline, args.threshold):
+            exit(1)
+
+
+if __name__ == "__main__":
+    main()
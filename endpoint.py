@@ -1,6 +1,8 @@
 from utils import Database, initiate_errors, parse_result
-from fastapi import FastAPI, Request
-from fastapi.responses import RedirectResponse, UJSONResponse
+from utils.ratelimit import default_limiter_storage
+from utils.stream import format_event
+from fastapi import FastAPI, Request, WebSocket
+from fastapi.responses import RedirectResponse, UJSONResponse, PlainTextResponse, StreamingResponse, JSONResponse
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.openapi.utils import get_openapi
 from slowapi import Limiter, _rate_limit_exceeded_handler  # noqa
@@ -8,21 +10,76 @@ from slowapi.util import get_remote_address
 from slowapi.errors import RateLimitExceeded
 from typing import List, Union, Dict
 from contextlib import asynccontextmanager
+from operator import itemgetter
+from itertools import groupby
 import utils
-import uvicorn
+import asyncio
 import json
 
-limiter = Limiter(key_func=get_remote_address)
+# counters live in shared memory, every worker of the host enforces the same limits
+limiter = Limiter(key_func=get_remote_address,
+                  storage_uri=getattr(utils.config, 'limiter_storage', default_limiter_storage))
+
+async def flush_demand(seconds=60):
+    # requests per world steer how often the updater refreshes them
+    while True:
+        await asyncio.sleep(seconds)
+
+        try:
+            await db.flush_demand()
+        except Exception as error:
+            print(f"Demand Flush Error: {error}")
+
+
+# point queries of the api, warm_queries runs them per hot world to prepare their statements
+by_id_query = 'SELECT * FROM {} WHERE id = $1'
+by_player_query = 'SELECT * FROM {} WHERE player_id = $1'
+by_name_query = 'SELECT * FROM {} WHERE LOWER(name) = $1'
+by_tag_query = 'SELECT * FROM {} WHERE LOWER(tag) = $1'
+
+warm_queries = {
+    'village': ((by_id_query, -1), (by_player_query, -1)),
+    'player': ((by_id_query, -1), (by_name_query, "")),
+    'tribe': ((by_id_query, -1), (by_name_query, ""), (by_tag_query, ""))
+}
+
+
+async def warm_up(retry_seconds=30):
+    # ready only flips once the hot worlds are warm, failed attempts get reported and retried
+    amount = getattr(utils.config, 'warm_worlds', 20)
+    concurrency = getattr(utils.config, 'warm_concurrency', 4)
+    timeout = getattr(utils.config, 'warm_timeout', 60)
+
+    while not db.ready:
+        try:
+            worlds = await asyncio.wait_for(db.warm_up(warm_queries, amount, concurrency), timeout)
+            print(f"Warmed up {len(worlds)} worlds")
+            break
+        except asyncio.TimeoutError:
+            db.warm_error = f"timed out after {timeout} seconds"
+        except Exception as error:
+            db.warm_error = repr(error)
+
+        print(f"Warm Up Error: {db.warm_error}")
+        utils.metrics.warm_failures.inc()
+        await asyncio.sleep(retry_seconds)
+
 
 @asynccontextmanager
 async def lifespan(_app: FastAPI):
     initiate_errors(_app)
     await db.connect()
     print("Connected to database")
+    flush_task = asyncio.create_task(flush_demand())
+
+    # requests are served right away, /ready tells the load balancer when the hot worlds are warm
+    warm_task = asyncio.create_task(warm_up())
 
     # waits till the end of the lifespan
     yield
 
+    warm_task.cancel()
+    flush_task.cancel()
     print("Disconnecting from database")
     await db.disconnect()
 
@@ -63,6 +120,8 @@ app.openapi = custom_openapi
 app.state.limiter = limiter
 app.add_exception_handler(RateLimitExceeded, _rate_limit_exceeded_handler)
 
+# only known worlds become labels, made up ones would grow the series without bound
+app.add_middleware(utils.MetricsMiddleware, worlds=lambda: db.worlds)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
@@ -78,6 +137,32 @@ async def home():
     return RedirectResponse('/docs')
 
 
+@app.get('/metrics', include_in_schema=False)
+async def get_metrics():
+    """# prometheus text format, counters are per worker process"""
+    db.report_pool()
+
+    # a scrape still renders the api metrics while the database is down
+    try:
+        query = 'SELECT duration, success, phases, counters FROM update_run ORDER BY id DESC LIMIT 1'
+        latest = await db.fetchone(query)
+    except Exception as error:
+        print(f"Metrics Update Run Error: {error}")
+        latest = None
+
+    if latest is not None:
+        utils.update_duration.set(latest['duration'])
+        utils.update_success.set(int(latest['success']))
+
+        for phase, seconds in json.loads(latest['phases']).items():
+            utils.update_phase_seconds.set(seconds, phase)
+
+        for name, value in json.loads(latest['counters']).items():
+            utils.update_counters.set(value, name)
+
+    return PlainTextResponse(utils.metrics.render(), media_type="text/plain; version=0.0.4")
+
+
 # WORLD
 @app.get('/world',
          tags=["World"],
@@ -140,39 +225,137 @@ async def get_world_settings(_: Request, world):
     return result
 
 
+@app.post('/world/travel/{world}',
+          tags=["World"],
+          response_model=utils.TravelResult,
+          summary="distances and travel times between villages of given world")
+@limiter.limit('10/minute')
+async def get_travel_times(_: Request, world, travel: utils.TravelRequest):
+    """# uses either the given pairs or every source x target combination"""
+    query = db.create_query('village', 'SELECT id, x, y FROM {} WHERE id = ANY($1)', world)
+    response = await db.fetchone('SELECT * FROM world WHERE world = $1', world, with_world=True)
+
+    pair_count = len(travel.pairs) or len(travel.sources) * len(travel.targets)
+    units = utils.verify_travel(travel.units, pair_count, json.loads(response['config']))
+    pairs = travel.pairs or [(source, target) for source in travel.sources for target in travel.targets]
+
+    village_ids = list({village_id for pair in pairs for village_id in pair})
+    villages = await db.fetch(query, village_ids, key='id')
+
+    for village_id in village_ids:
+        if village_id not in villages:
+            raise utils.error.InvalidArgument('village', village_id)
+
+    sources = [(villages[s]['x'], villages[s]['y']) for s, _ in pairs]
+    targets = [(villages[t]['x'], villages[t]['y']) for _, t in pairs]
+    distances, durations = utils.travel_times(sources, targets, response['speed'], response['unit_speed'], units)
+
+    results = []
+    for (source, target), distance, duration in zip(pairs, distances.tolist(), durations.tolist()):
+        results.append({'source': source, 'target': target,
+                        'distance': distance, 'duration': dict(zip(units, duration))})
+
+    return {'units': units, 'results': results}
+
+
+# LIST
+# a minute of full pages reads about as many rows as one list of a large world
+page_rate = '30/minute'
+
+
+def list_query(table, world, columns, bounds, after, limit):
+    """select of a world list endpoint, columns and bounds are verified by utils.parse"""
+    selected = "*" if columns is None else ", ".join(["id", *columns])
+    conditions, args = [], []
+
+    def bind(value):
+        args.append(value)
+        return f"${len(args)}::bigint"
+
+    for column, (low, high) in bounds.items():
+        if low is not None and low == high:
+            conditions.append(f"{column} = {bind(low)}")
+            continue
+
+        if low is not None:
+            conditions.append(f"{column} >= {bind(low)}")
+
+        if high is not None:
+            conditions.append(f"{column} <= {bind(high)}")
+
+    if after is not None:
+        conditions.append(f"id > {bind(after)}")
+
+    base_query = f"SELECT {selected} FROM {{}}"
+    if conditions:
+        base_query += " WHERE " + " AND ".join(conditions)
+
+    # keyset pages walk the primary key, no offset scans
+    if limit is not None:
+        base_query += f" ORDER BY id LIMIT {bind(limit)}"
+
+    return db.create_query(table, base_query, world), args
+
+
+async def world_list(ds_type, world, fields, filters, after, limit):
+    columns = utils.verify_fields(ds_type, fields)
+    bounds = utils.verify_filters(ds_type, filters)
+    utils.verify_page(after, limit)
+
+    strings = [key for key in utils.ds_strings[ds_type] if columns is None or key in columns]
+    mapped = db.mapped_table(ds_type, world)
+
+    if mapped is not None:
+        positions = None
+        if bounds or after is not None or limit is not None:
+            positions = mapped.select(bounds, after, limit)
+
+        response = mapped.records(columns=columns, positions=positions)
+    else:
+        query, args = list_query(ds_type, world, columns, bounds, after, limit)
+        workload = 'bulk' if limit is None else 'point'
+        response = await db.fetch(query, *args, key='id', workload=workload)
+
+    return parse_result(response, *strings, iterable=True)
+
+
 # VILLAGE
 @app.get('/village/{world}',
          tags=["Village"],
          response_class=UJSONResponse,
          summary="villages of given world")
 @limiter.limit('1/minute')
-async def get_villages_by_world(_: Request, world):
+async def get_villages_by_world(_: Request, world, fields: str = None, filters: str = None):
     """# returns id -> village dictionary"""
-    query = db.create_query('village', 'SELECT * FROM {}', world)
-    response = await db.fetch(query, key='id')
-    return parse_result(response, 'name', iterable=True)
+    return await world_list('village', world, fields, filters, None, None)
+
+
+@app.get('/village/{world}/page',
+         tags=["Village"],
+         response_class=UJSONResponse,
+         summary="page of the villages of given world")
+@limiter.limit(page_rate)
+async def get_village_page(_: Request, world, fields: str = None, filters: str = None,
+                           after: int = None, limit: int = utils.max_page_size):
+    """# returns id -> village dictionary of the next villages after the given id"""
+    return await world_list('village', world, fields, filters, after, limit)
 
 
 @app.get('/village/{world}/by-tribe/{tribe_id}',
          tags=["Village"],
-         response_model=List[utils.Village],
+         response_model=Dict[int, List[utils.Village]],
          summary="villages of given world and tribe id")
 @limiter.limit('20/minute')
 async def get_villages_by_tribe(_: Request, world, tribe_id: int):
-    base_query = 'SELECT * FROM {} WHERE player_id IN (SELECT id FROM {} WHERE tribe_id = $1)'
-    query = db.create_query(('village', 'player'), base_query, world)
-    response = await db.fetch(query, tribe_id)
-    tmp_result = parse_result(response, 'name', iterable=True)
+    """# returns player id -> villages dictionary"""
+    base_query = 'SELECT v.* FROM {} t JOIN {} v ON v.world = t.world AND v.id = ANY(t.villages) ' \
+                 'WHERE t.world = $1 AND t.tribe_id = $2 ORDER BY t.player_id'
+    query = db.create_query(('tribe_index', 'village'), base_query, world)
+    response = await db.fetch(query, world, tribe_id)
+    result = parse_result(response, 'name', iterable=True)
 
-    result = {}
-    for entry in tmp_result:
-        villages = result.get(entry['player_id'])
-        if villages is None:
-            result[entry['player_id']] = [entry]
-        else:
-            villages.append(entry)
-
-    return result
+    # rows arrive ordered by player already
+    return {player_id: list(villages) for player_id, villages in groupby(result, key=itemgetter('player_id'))}
 
 
 @app.get('/village/{world}/by-player/{player_id}',
@@ -181,7 +364,7 @@ async def get_villages_by_tribe(_: Request, world, tribe_id: int):
          summary="villages of given world and player id")
 @limiter.limit('30/minute')
 async def get_villages_by_player(_: Request, world, player_id: int):
-    query = db.create_query('village', 'SELECT * FROM {} WHERE player_id = $1', world)
+    query = db.create_query('village', by_player_query, world)
     response = await db.fetch(query, player_id)
     return parse_result(response, 'name', iterable=True)
 
@@ -192,8 +375,13 @@ async def get_villages_by_player(_: Request, world, player_id: int):
          summary="village of given world and village id")
 @limiter.limit('30/minute')
 async def get_village_by_id(_: Request, world, village_id: int):
-    query = db.create_query('village', 'SELECT * FROM {} WHERE id = $1', world)
-    response = await db.fetchone(query, village_id)
+    mapped = db.mapped_table('village', world)
+
+    if mapped is not None:
+        response = mapped.find(village_id)
+    else:
+        query = db.create_query('village', by_id_query, world)
+        response = await db.fetchone(query, village_id)
     return parse_result(response, 'name')
 
 
@@ -203,10 +391,20 @@ async def get_village_by_id(_: Request, world, village_id: int):
          response_class=UJSONResponse,
          summary="players of given world")
 @limiter.limit('1/minute')
-async def get_players_by_world(_: Request, world):
-    query = db.create_query('player', 'SELECT * FROM {}', world)
-    response = await db.fetch(query, key='id')
-    return parse_result(response, 'name', iterable=True)
+async def get_players_by_world(_: Request, world, fields: str = None, filters: str = None):
+    """# returns id -> player dictionary"""
+    return await world_list('player', world, fields, filters, None, None)
+
+
+@app.get('/player/{world}/page',
+         tags=["Player"],
+         response_class=UJSONResponse,
+         summary="page of the players of given world")
+@limiter.limit(page_rate)
+async def get_player_page(_: Request, world, fields: str = None, filters: str = None,
+                          after: int = None, limit: int = utils.max_page_size):
+    """# returns id -> player dictionary of the next players after the given id"""
+    return await world_list('player', world, fields, filters, after, limit)
 
 
 @app.get('/player/{world}/by-tribe/{tribe_id}',
@@ -215,8 +413,10 @@ async def get_players_by_world(_: Request, world):
          summary="players of given world and given tribe id")
 @limiter.limit('30/minute')
 async def get_players_by_tribe(_: Request, world, tribe_id: int):
-    query = db.create_query('player', 'SELECT * FROM {} WHERE tribe_id = $1', world)
-    response = await db.fetch(query, tribe_id, key='id')
+    base_query = 'SELECT p.* FROM {} t JOIN {} p ON p.world = t.world AND p.id = t.player_id ' \
+                 'WHERE t.world = $1 AND t.tribe_id = $2 ORDER BY t.player_id'
+    query = db.create_query(('tribe_index', 'player'), base_query, world)
+    response = await db.fetch(query, world, tribe_id)
     return parse_result(response, 'name', iterable=True)
 
 
@@ -226,7 +426,7 @@ async def get_players_by_tribe(_: Request, world, tribe_id: int):
          summary="player of given world and player name")
 @limiter.limit('30/minute')
 async def get_player_by_name(_: Request, world, player_name):
-    query = db.create_query('player', 'SELECT * FROM {} WHERE LOWER(name) = $1', world)
+    query = db.create_query('player', by_name_query, world)
     response = await db.fetch(query, player_name.lower())
     return parse_result(response, 'name')
 
@@ -237,8 +437,13 @@ async def get_player_by_name(_: Request, world, player_name):
          summary="player of given world and player id")
 @limiter.limit('30/minute')
 async def get_player_by_id(_: Request, world, player_id: int):
-    query = db.create_query('player', 'SELECT * FROM {} WHERE id = $1', world)
-    response = await db.fetchone(query, player_id)
+    mapped = db.mapped_table('player', world)
+
+    if mapped is not None:
+        response = mapped.find(player_id)
+    else:
+        query = db.create_query('player', by_id_query, world)
+        response = await db.fetchone(query, player_id)
     return parse_result(response, 'name')
 
 
@@ -248,10 +453,20 @@ async def get_player_by_id(_: Request, world, player_id: int):
          response_class=UJSONResponse,
          summary="tribes of given world")
 @limiter.limit('1/minute')
-async def get_tribes_by_world(_: Request, world):
-    query = db.create_query('tribe', 'SELECT * FROM {}', world)
-    response = await db.fetch(query, key='id')
-    return parse_result(response, 'name', 'tag', iterable=True)
+async def get_tribes_by_world(_: Request, world, fields: str = None, filters: str = None):
+    """# returns id -> tribe dictionary"""
+    return await world_list('tribe', world, fields, filters, None, None)
+
+
+@app.get('/tribe/{world}/page',
+         tags=["Tribe"],
+         response_class=UJSONResponse,
+         summary="page of the tribes of given world")
+@limiter.limit(page_rate)
+async def get_tribe_page(_: Request, world, fields: str = None, filters: str = None,
+                         after: int = None, limit: int = utils.max_page_size):
+    """# returns id -> tribe dictionary of the next tribes after the given id"""
+    return await world_list('tribe', world, fields, filters, after, limit)
 
 
 @app.get('/tribe/{world}/by-id/{tribe_id}',
@@ -260,8 +475,13 @@ async def get_tribes_by_world(_: Request, world):
          summary="tribe of given world and tribe id")
 @limiter.limit('30/minute')
 async def get_tribe_by_id(_: Request, world, tribe_id: int):
-    query = db.create_query('tribe', 'SELECT * FROM {} WHERE id = $1', world)
-    response = await db.fetchone(query, tribe_id)
+    mapped = db.mapped_table('tribe', world)
+
+    if mapped is not None:
+        response = mapped.find(tribe_id)
+    else:
+        query = db.create_query('tribe', by_id_query, world)
+        response = await db.fetchone(query, tribe_id)
     return parse_result(response, 'name', 'tag')
 
 
@@ -271,7 +491,7 @@ async def get_tribe_by_id(_: Request, world, tribe_id: int):
          summary="tribe of given world and tribe name")
 @limiter.limit('30/minute')
 async def get_tribe_by_name(_: Request, world, tribe_name):
-    query = db.create_query('tribe', 'SELECT * FROM {} WHERE LOWER(name) = $1', world)
+    query = db.create_query('tribe', by_name_query, world)
     response = await db.fetchone(query, tribe_name.lower())
     return parse_result(response, 'name', 'tag')
 
@@ -282,11 +502,54 @@ async def get_tribe_by_name(_: Request, world, tribe_name):
          summary="tribe of given world and tribe tag")
 @limiter.limit('30/minute')
 async def get_tribe_by_tag(_: Request, world, tribe_tag):
-    query = db.create_query('tribe', 'SELECT * FROM {} WHERE LOWER(tag) = $1', world)
+    query = db.create_query('tribe', by_tag_query, world)
     response = await db.fetchone(query, tribe_tag.lower())
     return parse_result(response, 'name', 'tag')
 
 
+@app.get('/tribe/{world}/by-id/{tribe_id}/continents',
+         tags=["Tribe"],
+         response_model=List[utils.TribeContinent],
+         summary="continent distribution of given world and tribe id")
+@limiter.limit('30/minute')
+async def get_tribe_continents(_: Request, world, tribe_id: int):
+    query = db.create_query('tribe_continent', 'SELECT * FROM {} WHERE tribe_id = $1 ORDER BY continent', world)
+    return await db.fetch(query, tribe_id)
+
+
+@app.get('/tribe/{world}/by-id/{tribe_id}/area',
+         tags=["Tribe"],
+         response_model=utils.TribeArea,
+         summary="bounding box and centroid of given world and tribe id")
+@limiter.limit('30/minute')
+async def get_tribe_area(_: Request, world, tribe_id: int):
+    query = db.create_query('tribe_area', 'SELECT * FROM {} WHERE tribe_id = $1', world)
+    return await db.fetchone(query, tribe_id)
+
+
+# CONTINENT
+@app.get('/continent/{world}',
+         tags=["Continent"],
+         response_model=Dict[int, utils.Continent],
+         summary="continent stats of given world")
+@limiter.limit('30/minute')
+async def get_continents_by_world(_: Request, world):
+    """# returns continent id -> stats dictionary"""
+    query = db.create_query('continent', 'SELECT * FROM {}', world)
+    response = await db.fetch(query)
+    return {row['id']: row for row in response}
+
+
+@app.get('/continent/{world}/{continent}',
+         tags=["Continent"],
+         response_model=utils.Continent,
+         summary="stats of given world and continent")
+@limiter.limit('30/minute')
+async def get_continent(_: Request, world, continent: int):
+    query = db.create_query('continent', 'SELECT * FROM {} WHERE id = $1', world)
+    return await db.fetchone(query, continent)
+
+
 # TOP
 @app.get('/tribe/{world}/top/{attribute}',
          tags=["Tribe"],
@@ -314,6 +577,42 @@ async def get_top_player_by_property(_: Request, world, attribute, amount: int =
     return parse_result(response, 'name', iterable=True)
 
 
+# GAINER
+gainer_query = 'SELECT e.*, u.delta FROM {0} g ' \
+               'CROSS JOIN LATERAL unnest(g.ids[1:$5], g.deltas[1:$5]) WITH ORDINALITY u(id, delta, position) ' \
+               'JOIN {1} e ON e.world = g.world AND e.id = u.id ' \
+               'WHERE g.world = $1 AND g.ds_type = $2 AND g.period = $3 AND g.attribute = $4 AND g.ordering = $6 ' \
+               'ORDER BY u.position'
+
+
+@app.get('/tribe/{world}/gainers/{attribute}',
+         tags=["Tribe"],
+         response_model=List[utils.TribeGainer],
+         summary="biggest tribe movers of given world, attribute and period")
+@limiter.limit('30/minute')
+async def get_tribe_gainers(_: Request, world, attribute, period: str = "hour", amount: int = 5, order: str = "DESC"):
+    """# DESC returns the biggest gainers, ASC the biggest losers"""
+    attribute = utils.verify_arguments(tribe_attribute=attribute, gainer_type='tribe',
+                                       period=period, amount=amount, order=order)
+    query = db.create_query(('gainer', 'tribe'), gainer_query, world)
+    response = await db.fetch(query, world, 'tribe', period, attribute, amount, order.upper())
+    return parse_result(response, 'name', 'tag', iterable=True)
+
+
+@app.get('/player/{world}/gainers/{attribute}',
+         tags=["Player"],
+         response_model=List[utils.PlayerGainer],
+         summary="biggest player movers of given world, attribute and period")
+@limiter.limit('30/minute')
+async def get_player_gainers(_: Request, world, attribute, period: str = "hour", amount: int = 5, order: str = "DESC"):
+    """# DESC returns the biggest gainers, ASC the biggest losers"""
+    attribute = utils.verify_arguments(player_attribute=attribute, gainer_type='player',
+                                       period=period, amount=amount, order=order)
+    query = db.create_query(('gainer', 'player'), gainer_query, world)
+    response = await db.fetch(query, world, 'player', period, attribute, amount, order.upper())
+    return parse_result(response, 'name', iterable=True)
+
+
 # RANDOM
 @app.get('/{ds_type}/{world}/random',
          tags=["Misc"],
@@ -329,6 +628,162 @@ async def get_random_elements_by_world(_: Request, ds_type, world, amount: int =
     return parse_result(data, 'name', iterable=amount > 1)
 
 
+# SEARCH
+@app.get('/search/{ds_type}/{name}',
+         tags=["Misc"],
+         response_model=List[utils.SearchResult],
+         summary="players or tribes with given name or tag across all worlds")
+@limiter.limit('30/minute')
+async def search_all_worlds(_: Request, ds_type, name):
+    """# tribes match by name or tag, results are ordered by points"""
+    if ds_type not in ('player', 'tribe'):
+        raise utils.error.InvalidArgument('ds_type', ds_type)
+
+    query = 'SELECT world, ds_type, id, name, tag, tribe_id, member, villages, points, rank FROM search ' \
+            'WHERE (name_key = $1 OR tag_key = $1) AND ds_type = $2 ORDER BY points DESC'
+    response = await db.fetch(query, name.lower(), ds_type, with_world=True)
+    return parse_result(response, 'name', 'tag', iterable=True)
+
+
+# STATUS
+@app.get('/status/updates',
+         tags=["Status"],
+         response_model=List[utils.UpdateRun],
+         summary="timings and counters of the latest update runs")
+@limiter.limit('30/minute')
+async def get_update_runs(_: Request, amount: int = 5, worlds: bool = False):
+    """# per world stats are only included if worlds is true"""
+    utils.verify_arguments(amount=amount)
+    columns = 'id, started, duration, worlds, success, phases, counters'
+
+    if worlds:
+        columns += ', world_stats'
+
+    response = await db.fetch(f'SELECT {columns} FROM update_run ORDER BY id DESC LIMIT $1', amount)
+
+    for row in response:
+        for key in ('phases', 'counters', 'world_stats'):
+            if key in row:
+                row[key] = json.loads(row[key])
+
+    return response
+
+
+@app.get('/status/indexes',
+         tags=["Status"],
+         response_model=List[utils.IndexUsage],
+         summary="size and usage of the partition indexes")
+@limiter.limit('10/minute')
+async def get_index_usage(_: Request):
+    """# sizes and scans are summed over every world"""
+    query = 'SELECT s.ds_type, substr(s.name, length(s.ds_type) + length(s.world) + 3) AS index, ' \
+            'count(*) AS partitions, sum(s.size)::bigint AS size, ' \
+            'sum(s.scans + COALESCE(i.idx_scan, 0))::bigint AS scans, max(s.measured) AS measured ' \
+            'FROM index_stats s LEFT JOIN pg_stat_user_indexes i ON i.indexrelname = s.name ' \
+            'GROUP BY 1, 2 ORDER BY 1, 2'
+    return await db.fetch(query)
+
+
+# HEALTH
+@app.get('/health', include_in_schema=False)
+async def get_health():
+    """# liveness, the process answers no matter the database"""
+    return {'status': "ok", 'pools': {pool.name: pool.healthy for pool in db.pools}}
+
+
+@app.get('/ready', include_in_schema=False)
+async def get_ready():
+    """# readiness, 503 until the hot worlds are warmed up"""
+    if not db.ready:
+        return JSONResponse({'status': "warming", 'error': db.warm_error}, status_code=503)
+
+    return {'status': "ready"}
+
+
+# STREAM
+def stream_worlds(worlds):
+    """verified worlds of a comma separated list, None subscribes to every world"""
+    if not worlds:
+        return None
+
+    result = {world.strip() for world in worlds.split(",") if world.strip()}
+    for world in result:
+        db.verify_world(world)
+
+    return result
+
+
+async def update_events(worlds, heartbeat=30):
+    with db.broadcaster.subscribe(worlds) as queue:
+        # the latest version of every table first, no need to poll after connecting
+        for event in db.broadcaster.current(worlds):
+            yield format_event(event)
+
+        while True:
+            try:
+                event = await asyncio.wait_for(queue.get(), heartbeat)
+            except asyncio.TimeoutError:
+                # comments keep proxies from closing idle connections
+                yield ": ping\n\n"
+                continue
+
+            yield format_event(event)
+
+
+@app.get('/stream/updates',
+         tags=["Status"],
+         response_class=StreamingResponse,
+         summary="server sent events of finished world updates")
+@limiter.limit('10/minute')
+async def stream_updates(_: Request, worlds: str = None):
+    """# streams an updated event with version and change counts per world and table"""
+    worlds = stream_worlds(worlds)
+    headers = {'Cache-Control': "no-cache", 'X-Accel-Buffering': "no"}
+    return StreamingResponse(update_events(worlds), media_type="text/event-stream", headers=headers)
+
+
+async def forward_events(websocket, queue):
+    while True:
+        await websocket.send_json(await queue.get())
+
+
+async def wait_disconnect(websocket):
+    # clients only ever send their disconnect
+    while (await websocket.receive())['type'] != "websocket.disconnect":
+        pass
+
+
+@app.websocket('/stream/updates/ws')
+async def stream_updates_socket(websocket: WebSocket, worlds: str = None):
+    try:
+        worlds = stream_worlds(worlds)
+    except utils.error.InvalidWorld:
+        await websocket.close(code=1008)
+        return
+
+    await websocket.accept()
+
+    with db.broadcaster.subscribe(worlds) as queue:
+        for event in db.broadcaster.current(worlds):
+            await websocket.send_json(event)
+
+        sender = asyncio.ensure_future(forward_events(websocket, queue))
+        receiver = asyncio.ensure_future(wait_disconnect(websocket))
+
+        # a failed send ends the subscription as well as a disconnect
+        try:
+            await asyncio.wait((sender, receiver), return_when=asyncio.FIRST_COMPLETED)
+        finally:
+            for task in (sender, receiver):
+                task.cancel()
+
+            results = await asyncio.gather(sender, receiver, return_exceptions=True)
+
+        for result in results:
+            if isinstance(result, Exception):
+                print(f"Update Stream Error: {result!r}")
+
+
 # UTIL
 @app.get('/attribute/tribe',
          tags=["Util"],
@@ -350,4 +805,5 @@ async def get_all_player_attributes(_: Request):
 
 # RUN
 if __name__ == "__main__":
+    import uvicorn
     uvicorn.run("endpoint:app", host="127.0.0.1", port=8000, log_level="info")
@@ -0,0 +1,80 @@
+"""world discovery of the updater against a fake transport, no database needed"""
+import datetime
+import pytest
+
+from bench.generate import generate_servers
+
+
+class Response:
+    def __init__(self, status_code, text=""):
+        self.status_code = status_code
+        self.text = text
+
+
+class Transport:
+    def __init__(self, responses):
+        self.responses = responses
+
+    def get(self, url):
+        return self.responses.get(url, Response(404))
+
+    def reset(self):
+        pass
+
+
+class Cursor:
+    def __init__(self, rows):
+        self.rows = rows
+        self.queries = []
+
+    def execute(self, query, args=None):
+        self.queries.append(query)
+
+    def fetchall(self):
+        return self.rows
+
+
+class Connection:
+    def __init__(self, cursor):
+        self.cur = cursor
+
+    def cursor(self):
+        return self.cur
+
+    def commit(self):
+        pass
+
+    def rollback(self):
+        pass
+
+
+@pytest.fixture
+def discovery(monkeypatch):
+    update = pytest.importorskip("update")
+
+    def build(responses, old_worlds):
+        cursor = Cursor([(world,) for world in old_worlds])
+        connections = [Connection(cursor), Connection(Cursor([]))]
+        monkeypatch.setattr(update.Cardinal, 'connect', staticmethod(lambda: iter(connections)))
+
+        cardinal = update.Cardinal("http://{}.{}", "http://{}", transport=Transport(responses))
+        cardinal.languages = {'zz': "zz.test", 'yy': "yy.test"}
+        return cardinal, cursor
+
+    return build
+
+
+@pytest.mark.parametrize("failure", [Response(404), Response(200, "<!DOCTYPE html><html></html>"), Response(200, "")])
+def test_failed_server_list_keeps_worlds(discovery, failure):
+    responses = {
+        "http://zz.test/backend/get_servers.php": Response(200, generate_servers(["zz1", "zz2"], "zz.test")),
+        "http://yy.test/backend/get_servers.php": failure
+    }
+
+    cardinal, cursor = discovery(responses, ["zz1", "zz2", "yy1"])
+
+    with pytest.raises(ValueError):
+        cardinal.update_worlds(datetime.datetime(2024, 1, 1, 5))
+
+    # nothing besides reading the known worlds happened, yy1 and its partitions survive
+    assert cursor.queries == ['SELECT world FROM world']
@@ -0,0 +1,37 @@
+"""hourly and daily movers from snapshot diffs"""
+import pytest
+
+gainer = pytest.importorskip("utils.gainer")
+
+
+def snapshot(records):
+    return gainer.Snapshot.build(records, ("points", "villages"))
+
+
+def test_rank_orders_gainers_and_losers():
+    previous = snapshot([(1, 10, 1), (2, 20, 2), (3, 30, 3), (4, 40, 4)])
+    # 3 vanished and 5 appeared, neither is a mover
+    current = snapshot([(5, 99, 9), (4, 40, 5), (2, 5, 2), (1, 15, 1)])
+
+    result = {(attribute, order): (ids.tolist(), deltas.tolist())
+              for attribute, order, ids, deltas in current.rank(previous)}
+
+    assert result == {
+        ('points', 'DESC'): ([1], [5]),
+        ('points', 'ASC'): ([2], [-15]),
+        ('villages', 'DESC'): ([4], [1]),
+        ('villages', 'ASC'): ([], [])
+    }
+
+
+def test_rank_limits_movers():
+    previous = snapshot([(entity, 0, 0) for entity in range(1, 6)])
+    current = snapshot([(entity, entity, 0) for entity in range(1, 6)])
+
+    ranked = {(attribute, order): ids.tolist() for attribute, order, ids, _ in current.rank(previous, limit=2)}
+    assert ranked[('points', 'DESC')] == [5, 4]
+
+
+def test_rank_without_previous_snapshot():
+    current = snapshot([(1, 10, 1)])
+    assert all(not len(ids) for _, _, ids, _ in current.rank(snapshot([])))
@@ -0,0 +1,70 @@
+"""map file parsing and the summaries computed at ingest"""
+import pytest
+
+ingest = pytest.importorskip("utils.ingest")
+
+
+def frame(rows, columns, strings=()):
+    return ingest.Frame.from_rows(rows, columns, strings)
+
+
+def lists(columns):
+    return [list(column) for column in columns]
+
+
+def test_tokenize_splits_lines():
+    tokens = ingest.tokenize("1,a,10\n2,b,20\n", 3)
+    assert tokens.tolist() == [["1", "a", "10"], ["2", "b", "20"]]
+    assert ingest.tokenize("\n", 3).shape == (0, 3)
+
+
+@pytest.mark.parametrize("text", ["1,a,10\n2,b", "1,a,10,5\n2,b,20", "1,a\n2,b,20,5", "1,a,10\n\n2,b,20"])
+def test_tokenize_rejects_lines_of_other_widths(text):
+    # a cut body must not pass as a shorter table
+    with pytest.raises(ValueError):
+        ingest.tokenize(text, 3)
+
+
+def test_join_writes_kill_files():
+    columns = ("id", "name", "points", "att_bash", "att_rank")
+    players = ingest.Frame.parse("2,b,20\n1,a,10\n", columns, ("name",), 3)
+    assert players.ids.tolist() == [1, 2]
+
+    # rank, id, points, unknown ids are ignored
+    players.join("1,2,99\n2,9,50\n", "att_bash", "att_rank")
+    assert players.column('att_bash').tolist() == [0, 99]
+    assert players.column('att_rank').tolist() == [0, 1]
+
+
+def test_join_rejects_cut_kill_file():
+    players = ingest.Frame.parse("1,a,10\n", ("id", "name", "points", "att_bash", "att_rank"), ("name",), 3)
+
+    with pytest.raises(ValueError):
+        players.join("1,1,99\n2,", "att_bash", "att_rank")
+
+
+def test_support_ranks():
+    tribes = frame([(1,), (2,), (3,)], ("id",))
+    players = frame([(10, 1, 5), (11, 1, 7), (12, 3, 20), (13, 0, 40), (14, 2, 0)], ("id", "tribe_id", "sup_bash"))
+
+    support, ranks = ingest.support_ranks(tribes, players)
+    assert support.tolist() == [12, 0, 20]
+    # tribes without support stay unranked
+    assert ranks.tolist() == [2, 0, 1]
+
+
+def test_summarize():
+    villages = frame([(1, 510, 520, 1, 100), (2, 520, 530, 2, 200), (3, 410, 420, 0, 50), (4, 420, 430, 1, 300)],
+                     ("id", "x", "y", "player_id", "points"))
+    players = frame([(1, 7), (2, 0), (3, 7)], ("id", "tribe_id"))
+
+    summaries = ingest.summarize(villages, players)
+
+    # continent, villages, barbarians, players, tribes, points
+    assert lists(summaries['continent']) == [[44, 55], [2, 2], [1, 0], [1, 2], [1, 1], [350, 300]]
+    # tribe, continent, villages, points
+    assert lists(summaries['tribe_continent']) == [[7, 7], [44, 55], [1, 1], [300, 100]]
+    # tribe, villages, points, min x, min y, max x, max y, center x, center y
+    assert lists(summaries['tribe_area']) == [[7], [2], [400], [420], [430], [510], [520], [465.0], [475.0]]
+    # tribe, player, village ids, players without villages included
+    assert lists(summaries['tribe_index']) == [[7, 0, 7], [1, 2, 3], ["{1,4}", "{2}", "{}"]]
@@ -0,0 +1,66 @@
+"""world tables written by the updater and mapped by the api workers"""
+import pytest
+
+mapped = pytest.importorskip("utils.mapped")
+ingest = pytest.importorskip("utils.ingest")
+
+columns = ("id", "name", "tribe_id", "points")
+
+
+def players(rows):
+    return ingest.Frame.from_rows(rows, columns, ("name",))
+
+
+@pytest.fixture
+def table(tmp_path):
+    frame = players([(3, "c%C3%A4", 0, 70000), (1, "a+b", 7, 300), (2, "", 7, 2 ** 40)])
+    path = mapped.write_table(str(tmp_path), "player", "zz1", frame, "2024-01-01T05:00:00")
+    return mapped.MappedTable(path)
+
+
+def test_round_trip(table):
+    assert (table.table, table.world, table.generation, len(table)) == ("player", "zz1", "2024-01-01T05:00:00", 3)
+
+    # names stay url encoded, big numbers keep a wide enough type
+    assert table.find(2) == {'id': 2, 'name': "", 'tribe_id': 7, 'points': 2 ** 40}
+    assert table.find(3) == {'id': 3, 'name': "c%C3%A4", 'tribe_id': 0, 'points': 70000}
+    assert table.find(4) is None
+    assert table.find(2 ** 70) is None
+
+    assert table.records(columns=["name"]) == {1: {'name': "a+b"}, 2: {'name': ""}, 3: {'name': "c%C3%A4"}}
+
+
+def test_select(table):
+    assert table.select({'tribe_id': (7, 7)}).tolist() == [0, 1]
+    assert table.select({'points': (1000, None)}).tolist() == [1, 2]
+    assert table.select(after=1, limit=1).tolist() == [1]
+
+    positions = table.select({'points': (None, 1000)})
+    assert table.records(columns=["points"], positions=positions) == {1: {'points': 300}}
+
+
+def test_empty_table(tmp_path):
+    path = mapped.write_table(str(tmp_path), "player", "zz2", players([]), "2024-01-01T05:00:00")
+    table = mapped.MappedTable(path)
+
+    assert len(table) == 0
+    assert table.records() == {}
+    assert table.find(1) is None
+
+
+def test_store_reloads_replaced_files(tmp_path):
+    directory = str(tmp_path)
+    mapped.write_table(directory, "player", "zz1", players([(1, "a", 0, 1)]), "first")
+
+    store = mapped.MappedStore(directory)
+    assert store.reload() == 1
+    first = store.get("player", "zz1")
+
+    # unchanged files keep their mapping, replaced ones get mapped again
+    store.reload()
+    assert store.get("player", "zz1") is first
+
+    mapped.write_table(directory, "player", "zz1", players([(1, "b", 0, 2)]), "second")
+    store.reload()
+    assert store.get("player", "zz1").find(1)['name'] == "b"
+    assert first.find(1)['name'] == "a"
@@ -0,0 +1,36 @@
+"""verification of the query parameters of the world lists"""
+import pytest
+
+parse = pytest.importorskip("utils.parse")
+
+
+def test_verify_filters():
+    assert parse.verify_filters('player', None) == {}
+    assert parse.verify_filters('player', "points:1000..5000, tribe_id:0,villages:10..") == \
+        {'points': (1000, 5000), 'tribe_id': (0, 0), 'villages': (10, None)}
+    assert parse.verify_filters('village', "x:..500") == {'x': (None, 500)}
+
+
+@pytest.mark.parametrize("filters", [
+    "unknown:1",
+    "name:abc",
+    "tag:1",
+    "points",
+    "points:",
+    "points:..",
+    "points:a..5",
+    "points:1..b",
+    "points:1.5",
+    f"points:{2 ** 63}",
+    f"points:{-2 ** 63 - 1}..",
+    "points:1,",
+])
+def test_verify_filters_rejects(filters):
+    with pytest.raises(parse.error.InvalidArgument):
+        parse.verify_filters('tribe', filters)
+
+
+@pytest.mark.parametrize("after, limit", [(2 ** 63, None), (None, 0), (None, -1), (None, parse.max_page_size + 1)])
+def test_verify_page_rejects(after, limit):
+    with pytest.raises(parse.error.InvalidArgument):
+        parse.verify_page(after, limit)
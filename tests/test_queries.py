@@ -0,0 +1,92 @@
+"""queries of the api and the updater against its schema, TW_TEST_DSN has to point to a scratch database"""
+import os
+import pytest
+
+dsn = os.environ.get("TW_TEST_DSN")
+pytestmark = pytest.mark.skipif(not dsn, reason="TW_TEST_DSN is not set")
+
+
+@pytest.fixture
+def cardinal(monkeypatch):
+    psycopg2 = pytest.importorskip("psycopg2")
+    update = pytest.importorskip("update")
+
+    connections = [psycopg2.connect(dsn), psycopg2.connect(dsn)]
+    monkeypatch.setattr(update.Cardinal, 'connect', staticmethod(lambda: iter(connections)))
+
+    cardinal = update.Cardinal()
+    cardinal.setup_tables()
+    cardinal.cursor = cardinal.conn.cursor()
+    cardinal.create_partitions(cardinal.cursor, ["zz1"])
+
+    try:
+        yield cardinal
+    finally:
+        # partitions and rows of the test vanish with the rollback
+        cardinal.conn.rollback()
+
+        for connection in connections:
+            connection.close()
+
+
+@pytest.fixture
+def cursor(cardinal):
+    return cardinal.cursor
+
+
+def execute(cursor, query, *args):
+    # the api runs $n placeholders through asyncpg, a prepared statement takes the same ones
+    cursor.execute(f"PREPARE api_query AS {query}")
+    cursor.execute(f"EXECUTE api_query ({', '.join(['%s'] * len(args))})", args)
+    rows = cursor.fetchall()
+    cursor.execute("DEALLOCATE api_query")
+    return rows
+
+
+def test_gainer_query(cursor):
+    endpoint = pytest.importorskip("endpoint")
+
+    cursor.execute("INSERT INTO player_zz1 (world, id, name, points) "
+                   "VALUES ('zz1', 1, 'a', 10), ('zz1', 2, 'b', 20), ('zz1', 3, 'c', 30)")
+    cursor.execute("INSERT INTO gainer_zz1 (world, ds_type, period, attribute, ordering, ids, deltas) "
+                   "VALUES ('zz1', 'player', 'hour', 'points', 'DESC', '{3,1,2}', '{30,10,5}')")
+
+    query = endpoint.gainer_query.format("gainer_zz1", "player_zz1")
+    rows = execute(cursor, query, "zz1", "player", "hour", "points", 2, "DESC")
+
+    # e.* starts with world and id, the delta comes last
+    assert [(row[1], row[-1]) for row in rows] == [(3, 30), (1, 10)]
+
+
+def test_membership_follows_players(cardinal, cursor):
+    cursor.execute("INSERT INTO tribe_index_zz1 (world, tribe_id, player_id, villages) "
+                   "VALUES ('zz1', 7, 1, '{11}'), ('zz1', 7, 2, '{12}'), ('zz1', 8, 4, '{14}')")
+    # 1 stays, 2 left the tribe, 3 is new and joined, 4 is gone
+    cursor.execute("INSERT INTO player_zz1 (world, id, name, tribe_id) "
+                   "VALUES ('zz1', 1, 'a', 7), ('zz1', 2, 'b', 8), ('zz1', 3, 'c', 7)")
+
+    cardinal.store_membership("zz1", "player_zz1")
+
+    cursor.execute("SELECT tribe_id, player_id, villages FROM tribe_index_zz1 ORDER BY player_id")
+    assert cursor.fetchall() == [(7, 1, [11]), (8, 2, [12]), (7, 3, [])]
+
+
+def test_swap_replaces_partition(cardinal, cursor, monkeypatch):
+    ingest = pytest.importorskip("utils.ingest")
+    cursor.execute("INSERT INTO village_zz1 (world, id, name, x, y, player_id, points) "
+                   "VALUES ('zz1', 1, 'old', 1, 1, 0, 26)")
+
+    columns = cardinal.layout("village")
+    for village_id in (2, 3):
+        row = [village_id if column == "id" else "new" if column == "name" else 0 for column in columns]
+        frame = ingest.Frame.from_rows([row], columns, cardinal.strings["village"])
+        monkeypatch.setattr(cardinal, 'data_packer', lambda table, world: frame)
+
+        # the second swap replaces a partition which was a staging table itself
+        cardinal.load("village", "zz1")
+
+        cursor.execute("SELECT id FROM village WHERE world = 'zz1'")
+        assert cursor.fetchall() == [(village_id,)]
+
+    cursor.execute("SELECT indexname FROM pg_indexes WHERE tablename = 'village_zz1' ORDER BY 1")
+    assert [row[0] for row in cursor.fetchall()] == ["village_zz1_pkey", "village_zz1_player_id"]
@@ -0,0 +1,74 @@
+"""update planning within the fetch budget"""
+import datetime
+import pytest
+
+schedule = pytest.importorskip("utils.schedule")
+
+cycle = datetime.datetime(2024, 1, 1, 5, 0)
+
+
+class Cursor:
+    """answers the two reads of Scheduler.plan and keeps the writes"""
+
+    def __init__(self, schedule_rows=(), demand_rows=()):
+        self.results = {'FROM world_schedule': list(schedule_rows), 'FROM world_demand': list(demand_rows)}
+        self.rows = []
+        self.intervals = {}
+        self.queries = []
+
+    def execute(self, query, args=None):
+        self.queries.append((query, args))
+        self.rows = next((rows for key, rows in self.results.items() if query.startswith("SELECT") and key in query), [])
+
+    def executemany(self, query, batch):
+        self.intervals = {world: minutes for world, minutes, _ in batch}
+
+    def fetchall(self):
+        return self.rows
+
+
+def scheduler(budget):
+    # ten map files per world update like the updater
+    return schedule.Scheduler(10, budget=budget, tick=15, shortest=15, longest=360)
+
+
+def plan(budget, schedule_rows=()):
+    # a changes a lot and gets most requests, b and c barely move
+    cursor = Cursor(schedule_rows or [("a", None, None, .5), ("b", None, None, .01), ("c", None, None, .01)],
+                    [("a", 100.)])
+    due = scheduler(budget).plan(cursor, ["a", "b", "c"], cycle)
+    return due, cursor
+
+
+@pytest.mark.parametrize("budget", [10, 30, 300])
+def test_plan_stays_within_budget(budget):
+    _, cursor = plan(budget)
+    fetches = sum(10 * 60 / minutes for minutes in cursor.intervals.values())
+
+    # over budget only if every world already waits the longest interval
+    assert fetches <= budget + 1e-9 or set(cursor.intervals.values()) == {360}
+
+
+def test_plan_prefers_busy_worlds():
+    due, cursor = plan(30)
+
+    assert cursor.intervals == {"a": 30, "b": 240, "c": 240}
+    # unknown worlds are due at once, busiest first
+    assert due == ["a", "b", "c"]
+
+
+def test_plan_waits_out_intervals():
+    rows = [("a", 30, cycle - datetime.timedelta(minutes=30), .5),
+            ("b", 240, cycle - datetime.timedelta(minutes=60), .01),
+            ("c", 240, None, .01)]
+    due, cursor = plan(30, rows)
+
+    assert due == ["a", "c"]
+    assert ('UPDATE world_schedule SET previous = updated, updated = %s WHERE world = ANY(%s)',
+            (cycle, ["a", "c"])) in cursor.queries
+
+
+def test_floor_counts_minutes_of_the_day():
+    # ticks not dividing an hour carry over into the next one
+    assert schedule.Scheduler(10, tick=25).floor(datetime.datetime(2024, 1, 1, 1, 20, 5)) == \
+        datetime.datetime(2024, 1, 1, 1, 15)
@@ -1,52 +1,74 @@
-from utils import config
-from collections import Counter
+from utils import config, parse, ingest
+from utils.gainer import Snapshot, array_literal
+from utils.transport import HttpTransport
+from utils.runstats import RunStats
+from utils.workqueue import WorkQueue
+from utils.schedule import Scheduler
+from utils.mapped import write_table, remove_world
+from utils.indexes import IndexManager
+from urllib.parse import unquote_plus
+from concurrent.futures import ThreadPoolExecutor
+from psycopg2.extras import execute_values
+from itertools import repeat
 import xmltodict
 import traceback
+import argparse
 import datetime
 import requests
 import psycopg2
+import socket
 import time
 import json
 import io
+import os
 import re
 
 
 # TODO: rewrite this mess properly when you got time
 
 class Cardinal:
-    def __init__(self):
+    languages = {
+        'de': "die-staemme.de",
+        'ch': "staemme.ch",
+        'en': "tribalwars.net",
+        'nl': "tribalwars.nl",
+        'pl': "plemiona.pl",
+        'br': "tribalwars.com.br",
+        'pt': "tribalwars.com.pt",
+        'cs': "divokekmeny.cz",
+        'ro': "triburile.ro",
+        'ru': "voynaplemyon.com",
+        'gr': "fyletikesmaxes.gr",
+        'sk': "divoke-kmene.sk",
+        'it': "tribals.it",
+        'tr': "klanlar.org",
+        'fr': "guerretribale.fr",
+        'es': "guerrastribales.es",
+        'ae': "tribalwars.ae",
+        'uk': "tribalwars.co.uk",
+        'us': "tribalwars.us"
+    }
+
+    def __init__(self, world_url="https://{}.{}", server_url="https://{}", transport=None):
         self.worlds = []
         self.max_archived_days = 30
         self.do_daily = False
-        self.session = requests.Session()
+        self.transport = transport or HttpTransport()
+        # directory of the memory mapped tables shared with the api workers
+        self.snapshot_path = getattr(config, 'snapshot_path', None)
+        # parallel requests of the hourly world discovery
+        self.discovery_workers = getattr(config, 'discovery_workers', 16)
+        self.stats = RunStats()
         self.cursor = None
         self.conn, self.res = self.connect()
 
-        self.languages = {
-            'de': "die-staemme.de",
-            'ch': "staemme.ch",
-            'en': "tribalwars.net",
-            'nl': "tribalwars.nl",
-            'pl': "plemiona.pl",
-            'br': "tribalwars.com.br",
-            'pt': "tribalwars.com.pt",
-            'cs': "divokekmeny.cz",
-            'ro': "triburile.ro",
-            'ru': "voynaplemyon.com",
-            'gr': "fyletikesmaxes.gr",
-            'sk': "divoke-kmene.sk",
-            'it': "tribals.it",
-            'tr': "klanlar.org",
-            'fr': "guerretribale.fr",
-            'es': "guerrastribales.es",
-            'ae': "tribalwars.ae",
-            'uk': "tribalwars.co.uk",
-            'us': "tribalwars.us"
-        }
-
         self.types = ("player", "tribe", "village", "world")
 
-        self.base = "https://{}.{}/map"
+        # formatted with world and domain, server url only with the domain
+        self.world_url = world_url
+        self.server_url = server_url
+
+        self.base = f"{world_url}/map"
         self.player_url = (
             f"{self.base}/player.txt",
             f"{self.base}/kill_att.txt",
@@ -66,6 +88,10 @@ class Cardinal:
             f"{self.base}/village.txt",
         )
 
+        fetches = len(self.player_url) + len(self.tribe_url) + len(self.village_url)
+        self.scheduler = Scheduler(fetches)
+        self.indexes = IndexManager()
+
         self.player_create = (
             "world VARCHAR(6)",
             "id BIGINT",
@@ -126,11 +152,171 @@ class Cardinal:
             "config JSON"
         )
 
-        self.empty = ["0", "0", "0", "0", "0", "0", "0", "0"]
+        # derived tables precomputed while packing the data
+        self.summaries = ("continent", "tribe_continent", "tribe_area", "tribe_index", "gainer")
+
+        self.continent_create = (
+            "world VARCHAR(6)",
+            "id SMALLINT",
+            "villages INT",
+            "barbarians INT",
+            "players INT",
+            "tribes INT",
+            "points BIGINT",
+            "PRIMARY KEY (world, id)"
+        )
+
+        self.tribe_continent_create = (
+            "world VARCHAR(6)",
+            "tribe_id INT",
+            "continent SMALLINT",
+            "villages INT",
+            "points BIGINT",
+            "PRIMARY KEY (world, tribe_id, continent)"
+        )
+
+        self.tribe_area_create = (
+            "world VARCHAR(6)",
+            "tribe_id INT",
+            "villages INT",
+            "points BIGINT",
+            "min_x SMALLINT",
+            "min_y SMALLINT",
+            "max_x SMALLINT",
+            "max_y SMALLINT",
+            "center_x REAL",
+            "center_y REAL",
+            "PRIMARY KEY (world, tribe_id)"
+        )
+
+        # tribe -> player -> village ids, sorted by the primary key
+        self.tribe_index_create = (
+            "world VARCHAR(6)",
+            "tribe_id INT",
+            "player_id BIGINT",
+            "villages INT[]",
+            "PRIMARY KEY (world, tribe_id, player_id)"
+        )
+
+        # movers sorted by delta, ordering ASC holds the losers
+        self.gainer_create = (
+            "world VARCHAR(6)",
+            "ds_type VARCHAR(6)",
+            "period VARCHAR(4)",
+            "attribute VARCHAR(10)",
+            "ordering VARCHAR(4)",
+            "ids BIGINT[]",
+            "deltas BIGINT[]",
+            "PRIMARY KEY (world, ds_type, period, attribute, ordering)"
+        )
+
+        # cross world name index, maintained per world while loading
+        self.search_create = (
+            "world VARCHAR(6)",
+            "ds_type VARCHAR(6)",
+            "id BIGINT",
+            "name_key VARCHAR(384)",
+            "tag_key VARCHAR(72)",
+            "name VARCHAR(384)",
+            "tag VARCHAR(72)",
+            "tribe_id INT",
+            "member SMALLINT",
+            "villages INT",
+            "points BIGINT",
+            "rank INT",
+            "PRIMARY KEY (world, ds_type, id)"
+        )
+
+        self.search_indexes = (
+            "CREATE INDEX IF NOT EXISTS search_name_key ON search (name_key, ds_type)",
+            "CREATE INDEX IF NOT EXISTS search_tag_key ON search (tag_key, ds_type)"
+        )
+
+        # timings and counters of every update run
+        self.update_run_create = (
+            "id SERIAL PRIMARY KEY",
+            "started TIMESTAMP",
+            "duration REAL",
+            "worlds SMALLINT",
+            "success BOOLEAN",
+            "phases JSON",
+            "counters JSON",
+            "world_stats JSON"
+        )
+
+        # interval per world and api requests per world and hour
+        self.world_schedule_create = (
+            "world VARCHAR(6) PRIMARY KEY",
+            "minutes SMALLINT",
+            "updated TIMESTAMP",
+            "previous TIMESTAMP",
+            "change REAL",
+            "demand REAL"
+        )
+
+        self.world_demand_create = (
+            "world VARCHAR(6)",
+            "hour TIMESTAMP",
+            "requests INT",
+            "PRIMARY KEY (world, hour)"
+        )
+
+        # work queue of the distributed updater, one cycle per scheduler tick
+        self.update_cycle_create = (
+            "cycle TIMESTAMP PRIMARY KEY",
+            "started TIMESTAMP",
+            "finished TIMESTAMP",
+            "success BOOLEAN"
+        )
+
+        self.update_job_create = (
+            "cycle TIMESTAMP",
+            "world VARCHAR(6)",
+            "ds_type VARCHAR(7)",
+            "step SMALLINT",
+            "state VARCHAR(7) DEFAULT 'pending'",
+            "worker VARCHAR(64)",
+            "leased_until TIMESTAMPTZ",
+            "attempts SMALLINT DEFAULT 0",
+            "PRIMARY KEY (cycle, world, ds_type)"
+        )
+
+        # size of the declared partition indexes after the latest swap,
+        # scans of the partitions replaced by swaps since their statistics vanish with them
+        self.index_stats_create = (
+            "world VARCHAR(6)",
+            "ds_type VARCHAR(7)",
+            "name VARCHAR(63)",
+            "size BIGINT",
+            "scans BIGINT DEFAULT 0",
+            "measured TIMESTAMPTZ",
+            "PRIMARY KEY (world, ds_type, name)"
+        )
+
+        # string columns and column count of the base map files
+        self.strings = {'player': ("name",), 'tribe': ("name", "tag"), 'village': ("name",)}
+        self.widths = {'player': 6, 'tribe': 8, 'village': 7}
+
+        # bash columns filled by the kill files in url order
+        self.kills = {'player': ("att", "def", "sup", "all"), 'tribe': ("att", "def", "all")}
+
+        # player frames per world, needed for tribe support and village summaries
+        self.frames = {}
 
-        # Own Calculation since Inno doesn't support it
-        self.tribe_support = {}
-        self.tribe_support_rank = {}
+        # (table, world) -> stats of the last hour and of the last midnight
+        self.snapshots = {}
+        self.daily_snapshots = {}
+
+        # cycle of the running update and the one each hourly snapshot was taken in
+        self.cycle = None
+        self.snapshot_taken = {}
+
+        # worker mode only, cycle of each last load and day of the daily snapshots
+        self.snapshot_cycles = {}
+        self.daily_day = None
+
+        # (table, world) -> change counts of the running load, sent with its update event
+        self.changes = {}
 
     @staticmethod
     def connect():
@@ -155,7 +341,7 @@ class Cardinal:
         print("Attempting to reconnect")
 
         try:
-            self.session = requests.Session()
+            self.transport.reset()
             self.conn, self.res = self.connect()
             self.run()
         except Exception as e:
@@ -168,7 +354,7 @@ class Cardinal:
 
         while True:
             if restart == 0:
-                seconds = self.get_seconds_till_hour()
+                seconds = self.get_seconds_till_tick()
                 time.sleep(seconds)
 
             response = self.update()
@@ -190,142 +376,518 @@ class Cardinal:
 
     def update(self):
         start = datetime.datetime.now()
+        self.stats = RunStats()
+        self.cycle = self.scheduler.floor(start)
+        first_tick = self.scheduler.first_tick(self.cycle)
 
         # archive every day at 12 pm
-        if start.hour == 0:
+        if start.hour == 0 and first_tick:
             self.do_daily = True
 
-        try:
-            self.worlds = self.update_worlds(start)
-        except Exception as error:
-            print(f"World Update Error: {error}")
+        # worlds and configs are refreshed once an hour
+        if first_tick or not self.worlds:
+            try:
+                with self.stats.phase("worlds"):
+                    self.worlds = self.update_worlds(start)
+            except Exception as error:
+                print(f"World Update Error: {error}")
 
-            # if no initial world load worked
-            if not self.worlds:
-                return False
+                # if no initial world load worked
+                if not self.worlds:
+                    self.record_run(False)
+                    return False
+
+        due = []
 
         try:
-            self.update_data()
-            self.send_code("200")
+            with self.stats.phase("schedule"):
+                due = self.schedule(self.worlds)
+
+            # nothing changed, api workers keep their worlds and subscribers hear nothing
+            if due:
+                self.update_data(due)
+                self.send_code("200")
         except Exception as e:
             print(f"EXCEPTION OCCURRED {e}")
             traceback.print_exc()
+            self.unschedule(due)
+            self.record_run(False)
             return False
 
         if self.do_daily:
-            self.archive()
+            with self.stats.phase("archive"):
+                self.archive()
+
+            self.daily_snapshots = self.snapshots.copy()
             self.do_daily = False
 
         end = datetime.datetime.now()
         current = datetime.datetime.strftime(end, "%H:%M")
-        print(f"{current} | Updated {len(self.worlds)} worlds in {end - start}")
+        print(f"{current} | Updated {len(due)} of {len(self.worlds)} worlds in {end - start}")
+
+        if due:
+            print(f"{current} | {self.stats.summary()}")
+            self.record_run(True)
+
         return True
 
-    def update_data(self):
+    def schedule(self, worlds):
+        cur = self.conn.cursor()
+        due = self.scheduler.plan(cur, worlds, self.cycle)
+        self.conn.commit()
+        return due
+
+    def unschedule(self, worlds):
+        # the retry within the same tick finds the worlds of the failed run due again
+        if not worlds:
+            return
+
+        try:
+            cur = self.res.cursor()
+            self.scheduler.revert(cur, worlds, self.cycle)
+            self.res.commit()
+        except Exception as e:
+            print(f"EXCEPTION OCCURRED UNSCHEDULING {e}")
+            traceback.print_exc()
+
+    def record_run(self, success):
+        # the notify connection stays usable if the main one failed
+        try:
+            cur = self.res.cursor()
+            self.stats.record(cur, success)
+            self.res.commit()
+        except Exception as e:
+            print(f"EXCEPTION OCCURRED RECORDING RUN {e}")
+            traceback.print_exc()
+
+    def run_worker(self, worker, lease_seconds=900, poll_seconds=5):
+        # looping instead of recursing, workers are meant to run for months
+        while True:
+            try:
+                self.setup_tables()
+                queue = WorkQueue(self.conn, worker, lease_seconds)
+                self.work(queue, poll_seconds)
+            except Exception as e:
+                print(f"EXCEPTION OCCURRED {e}")
+                traceback.print_exc()
+
+            time.sleep(10)
+            print("Attempting to reconnect")
+
+            try:
+                self.transport.reset()
+                self.conn, self.res = self.connect()
+            except Exception as e:
+                print(f"RECONNECT FAILED {e}")
+                traceback.print_exc()
+
+    def work(self, queue, poll_seconds):
+        while True:
+            # the scheduler floors the cycle, the same way the plan and first_tick do
+            cycle, _ = queue.start(self.scheduler.floor(queue.now()))
+            queue.reclaim()
+            job = queue.lease()
+
+            if job is not None:
+                self.process(queue, job)
+                self.settle(queue, job.cycle)
+                continue
+
+            self.settle(queue, cycle)
+
+            # other workers still hold jobs which may unlock new ones
+            if queue.pending(cycle):
+                time.sleep(poll_seconds)
+            else:
+                self.record_cycle()
+                # woken by the local clock a worker ahead of the database would reopen the finished cycle
+                time.sleep(self.get_seconds_till_tick(queue.now()))
+
+    def begin_cycle(self, cycle):
+        self.record_cycle()
+        self.cycle = cycle
+        self.frames.clear()
+
+        # daily snapshots stay valid until the next midnight cycle archived
+        day = (cycle - datetime.timedelta(minutes=self.scheduler.tick)).date()
+        if day != self.daily_day:
+            self.daily_snapshots.clear()
+            self.daily_day = day
+
+    def record_cycle(self):
+        if not self.stats.phases:
+            return
+
+        current = datetime.datetime.strftime(datetime.datetime.now(), "%H:%M")
+        print(f"{current} | {self.stats.summary()}")
+        self.record_run(not self.stats.counters["failed_jobs"])
+        self.stats = RunStats()
+
+    def process(self, queue, job):
+        if job.cycle != self.cycle:
+            self.begin_cycle(job.cycle)
+
+        world = job.world or None
         self.cursor = self.conn.cursor()
 
-        for table in self.types[:-1]:
-            cache = self.create_temp(table)
-            # ignoring the last element (primary key definition)
-            values = [col.split()[0] for col in cache[:-1]]
+        try:
+            if job.ds_type == "world":
+                with self.stats.phase("worlds"):
+                    queue.reschedule_failed(self.cursor)
+                    queue.enqueue(job.cycle, self.discover(job.cycle))
+            else:
+                self.rehydrate(job)
+                frame = self.load(job.ds_type, job.world)
+
+            # a reclaimed lease belongs to another worker now, whose data must not be swapped over
+            if not queue.complete(job):
+                print(f"LEASE LOST {job}")
+                self.conn.rollback()
+                self.forget(job)
+                self.stats.count("lost_leases", world=world)
+                return
+
+            # job state and data commit together
+            with self.stats.phase("commit", world):
+                self.conn.commit()
+
+            if job.ds_type != "world":
+                self.publish(job.ds_type, job.world, frame)
+                self.send_update(job.ds_type, job.world, frame)
+
+        except Exception as e:
+            print(f"EXCEPTION OCCURRED {job} {e}")
+            traceback.print_exc()
+            self.conn.rollback()
+            self.forget(job)
+
+            self.stats.count("failed_jobs", world=world)
+            queue.fail(job)
+
+        finally:
+            self.cursor.close()
+
+    def forget(self, job):
+        # in memory state of an uncommitted load can't be trusted
+        self.snapshots.pop((job.ds_type, job.world), None)
+        self.snapshot_taken.pop((job.ds_type, job.world), None)
+        self.frames.pop(job.world, None)
+        self.changes.pop((job.ds_type, job.world), None)
+
+    def discover(self, cycle):
+        worlds = None
+
+        # worlds and configs are refreshed once an hour
+        if self.scheduler.first_tick(cycle):
+            try:
+                worlds = self.update_worlds(cycle)
+            except Exception as error:
+                print(f"World Update Error: {error}")
+                self.conn.rollback()
+
+        # the world table still holds the last successful discovery
+        if not worlds:
+            self.cursor.execute('SELECT world FROM world')
+            worlds = [row[0] for row in self.cursor.fetchall()]
+
+        if not worlds:
+            raise ValueError("no worlds to update")
 
-            for world in self.worlds:
-                if table == "tribe":
-                    tribe_support_world = self.tribe_support.get(world, {})
+        self.worlds = worlds
+        return self.scheduler.plan(self.cursor, worlds, cycle)
 
-                    ranked_support = list(tribe_support_world.items())
-                    ranked_support.sort(key=lambda l: l[1], reverse=True)
+    def rehydrate(self, job):
+        # hourly diffs only hold if this worker did the last update of the world
+        key = (job.ds_type, job.world)
+        if self.snapshot_cycles.get(key) != self.scheduler.previous(self.cursor, job.world):
+            self.snapshots.pop(key, None)
+            self.snapshot_taken.pop(key, None)
 
-                    for index, (tribe_id, _) in enumerate(ranked_support, start=1):
-                        self.tribe_support_rank[tribe_id] = str(index)
+        self.snapshot_cycles[key] = job.cycle
 
-                data = self.data_packer(table, world)
-                file = io.StringIO("\n".join(data))
-                self.cursor.copy_from(file, "cache", columns=values, sep=',')
-                table_name = f"{table}_{world}"
+        # players of this cycle are committed before tribes get leased
+        if job.ds_type == "tribe" and job.world not in self.frames:
+            self.frames[job.world] = self.fetch_old_data("player", job.world)
 
-                query = f'LOCK TABLE {table_name};' \
-                        f'TRUNCATE TABLE {table_name};' \
-                        f'INSERT INTO {table_name} SELECT * FROM "cache";' \
-                        f'TRUNCATE TABLE "cache";'
+    def settle(self, queue, cycle):
+        success = queue.finish(cycle)
+
+        if success is None:
+            self.conn.commit()
+            return
+
+        # delivered with the commit of the barrier
+        cur = self.conn.cursor()
+        cur.execute("NOTIFY log, '200'")
+        self.conn.commit()
+
+        current = datetime.datetime.strftime(datetime.datetime.now(), "%H:%M")
+        print(f"{current} | Finished cycle {cycle:%H:%M}, success: {success}")
+
+        if cycle.hour == 0 and self.scheduler.first_tick(cycle):
+            with self.stats.phase("archive"):
+                self.archive()
+
+            queue.cleanup(self.max_archived_days)
+            self.conn.commit()
+
+    def update_data(self, worlds=None):
+        self.cursor = self.conn.cursor()
+
+        # every world at once outside of the schedule
+        if worlds is None:
+            worlds = self.worlds
+            self.cycle = self.scheduler.floor(datetime.datetime.now())
+
+        for table in self.types[:-1]:
+            for world in worlds:
+                frame = self.load(table, world)
 
-                self.cursor.execute(query)
                 # per world instead of all at once
-                self.tribe_support_rank.clear()
-                self.conn.commit()
+                with self.stats.phase("commit", world):
+                    self.conn.commit()
 
-        self.tribe_support.clear()
+                self.publish(table, world, frame)
+                self.send_update(table, world, frame)
+
+        self.frames.clear()
         self.cursor.close()
 
-    def data_packer(self, table, world):
-        # 2 less because of the first iteration
-        pointer = 6 if table == "tribe" else 4
-        urls = getattr(self, f"{table}_url")
-        data_pack = {}
+    def load(self, table, world):
+        # ignoring the last element (primary key definition)
+        values = [col.split()[0] for col in getattr(self, f"{table}_create")[:-1]]
+        frame = self.data_packer(table, world)
+        self.stats.count(f"{table}_rows", len(frame), world)
+
+        if table == "player":
+            self.frames[world] = frame
+
+        elif table == "tribe":
+            players = self.frames.get(world)
+
+            # own calculation since inno doesn't support it
+            if players is not None:
+                support, ranks = ingest.support_ranks(frame, players)
+                frame.numbers[:, frame.index['sup_bash']] = support
+                frame.numbers[:, frame.index['sup_rank']] = ranks
+
+        # diffing against the live partition before it gets replaced
+        if table in parse.gainer_stats:
+            with self.stats.phase("gainer", world):
+                self.store_gainers(table, world, frame)
+
+            with self.stats.phase("search", world):
+                self.store_search(table, world, frame)
+
+        # loaded and indexed next to the live partition, readers keep using it meanwhile
+        table_name = f"{table}_{world}"
+        staging = f"{table_name}_next"
+
+        with self.stats.phase("copy", world):
+            self.cursor.execute(f'DROP TABLE IF EXISTS {staging};'
+                                f'CREATE TABLE {staging} (LIKE {table_name} INCLUDING DEFAULTS);')
+            file = io.StringIO(frame.to_copy(world))
+            self.cursor.copy_from(file, staging, columns=values, sep=',')
+
+        with self.stats.phase("index", world):
+            # the check spares the attach a scan for rows of other worlds
+            primary_key = getattr(self, f"{table}_create")[-1]
+            query = f'ALTER TABLE {staging} ADD CONSTRAINT {staging}_pkey {primary_key}, ' \
+                    f'ADD CONSTRAINT world_partition CHECK (world IS NOT NULL AND world = \'{world}\');' \
+                    f'{"".join(self.indexes.build(table, world))}' \
+                    f'ANALYZE {staging};'
+            self.cursor.execute(query)
+
+        # members of a tribe change with the players, not with the next village step
+        if table == "player":
+            with self.stats.phase("summary", world):
+                self.store_membership(world, staging)
+
+        # summaries become visible together with the villages
+        if table == "village":
+            with self.stats.phase("summary", world):
+                players = self.frames.pop(world, None)
+
+                if players is None:
+                    players = self.fetch_old_data("player", world)
+
+                summaries = ingest.summarize(frame, players)
+                self.store_summaries(world, summaries)
+
+        # only catalog changes and last, the exclusive locks are held until the commit
+        query = f'ALTER TABLE {table} DETACH PARTITION {table_name};' \
+                f'DROP TABLE {table_name};' \
+                f'ALTER TABLE {staging} RENAME TO {table_name};' \
+                f'ALTER INDEX {staging}_pkey RENAME TO {table_name}_pkey;' \
+                f'{"".join(self.indexes.rename(table, world))}' \
+                f'ALTER TABLE {table} ATTACH PARTITION {table_name} FOR VALUES IN (\'{world}\');'
+
+        with self.stats.phase("swap", world):
+            self.indexes.keep_scans(self.cursor, table, world)
+            self.cursor.execute(query)
+            self.indexes.record_size(self.cursor, table, world)
+
+        return frame
+
+    def publish(self, table, world, frame):
+        if self.snapshot_path is None:
+            return
 
-        for index, base in enumerate(urls):
-            domain = self.languages[world[:2]]
-            url = base.format(world, domain)
+        # a failed write leaves the api on the previous generation
+        try:
+            with self.stats.phase("publish", world):
+                write_table(self.snapshot_path, table, world, frame, self.cycle.isoformat())
+        except OSError as error:
+            print(f"Publish Error: {error}")
+            self.stats.count("publish_errors", world=world)
+
+    def store_gainers(self, table, world, frame):
+        attributes = parse.gainer_stats[table]
+        pointers = [frame.index[attribute] for attribute in attributes]
+        snapshot = Snapshot(frame.ids.copy(), frame.numbers[:, pointers], tuple(attributes))
+        key = (table, world)
+
+        # the live partition holds the state of the last update
+        if key not in self.snapshots:
+            self.snapshot_taken[key] = self.scheduler.previous(self.cursor, world)
+
+        data = []
+        for period in parse.gainer_periods:
+            previous = self.previous_snapshot(table, world, period)
+            if previous is None:
+                continue
 
-            cache = self.secure_get(url)
-            if cache is None:
-                return self.fetch_old_data(table, world)
+            for attribute, ordering, ids, deltas in snapshot.rank(previous):
+                batch = [table, period, attribute, ordering, array_literal(ids), array_literal(deltas)]
+                data.append("\t".join([world, *batch]))
 
-            lines = cache.text.split('\n')
+        values = [col.split()[0] for col in self.gainer_create[:-1]]
+        self.cursor.execute(f'DELETE FROM gainer_{world} WHERE ds_type = %s;', (table,))
+        self.cursor.copy_from(io.StringIO("\n".join(data)), f"gainer_{world}", columns=values, sep='\t')
 
-            if not lines:
-                continue
+        previous, taken = self.snapshots.get(key), self.snapshot_taken.get(key)
+        if previous is not None:
+            since = taken.isoformat() if taken is not None else None
+            self.changes[key] = {**snapshot.changes(previous), 'since': since}
 
-            elif lines[0].startswith("<!DOCTYPE html>"):
-                return self.fetch_old_data(table, world)
+        if table == "player" and previous is not None and taken is not None:
+            hours = max((self.cycle - taken).total_seconds() / 3600, self.scheduler.tick / 60)
+            self.scheduler.observe(self.cursor, world, snapshot.changed(previous) / hours)
 
-            for line in lines:
+        # worlds updated more often keep diffing against the snapshot of the last hour
+        if taken is None or self.cycle - taken >= datetime.timedelta(hours=1):
+            self.snapshots[key] = snapshot
+            self.snapshot_taken[key] = self.cycle
 
-                if not line:
-                    continue
+    def store_search(self, table, world, frame):
+        size = len(frame)
+        names = frame.strings['name'].tolist()
+        tags = frame.strings['tag'].tolist() if table == "tribe" else [""] * size
 
-                # first url everything besides bash data
-                if index == 0:
-                    entry = line.split(',')
+        if table == "tribe":
+            tribe_ids, members = repeat("0", size), map(str, frame.column('member').tolist())
+        else:
+            tribe_ids, members = map(str, frame.column('tribe_id').tolist()), repeat("0", size)
 
-                    if table == 'player':
-                        entry += self.empty
-                    elif table == 'tribe':
-                        # 6 inno entries + custom sup bash
-                        entry += self.empty[:8]
+        # keys are decoded and lowered, names stay encoded like everywhere else
+        name_keys = [escape_copy(unquote_plus(name)).lower() for name in names]
+        tag_keys = [escape_copy(unquote_plus(tag)).lower() for tag in tags]
+        stats = [map(str, frame.column(column).tolist()) for column in ("villages", "points", "rank")]
 
-                        local_tribe_support = self.tribe_support.get(world, {})
-                        support_points = local_tribe_support.get(entry[0], 0)
-                        entry[-2] = str(support_points)
+        columns = [map(str, frame.ids.tolist()), name_keys, tag_keys, names, tags, tribe_ids, members, *stats]
+        data = map("\t".join, zip(repeat(world, size), repeat(table, size), *columns))
 
-                        local_tribe_support_rank = self.tribe_support_rank.get(entry[0], "0")
-                        entry[-1] = local_tribe_support_rank
+        values = [col.split()[0] for col in self.search_create[:-1]]
+        self.cursor.execute('DELETE FROM search WHERE world = %s AND ds_type = %s;', (world, table))
+        self.cursor.copy_from(io.StringIO("\n".join(data)), "search", columns=values, sep='\t')
 
-                    data_pack[entry[0]] = entry
+    def previous_snapshot(self, table, world, period):
+        cache = self.snapshots if period == "hour" else self.daily_snapshots
+        snapshot = cache.get((table, world))
 
-                # bash data
-                else:
-                    try:
-                        rank, id_, bash_points = line.split(',')
-                        data_pack[id_][pointer] = bash_points
-                        data_pack[id_][pointer + 1] = rank
+        if snapshot is not None:
+            return snapshot
 
-                        if index == 3 and table == 'player':
-                            tribe_support_world = self.tribe_support.get(world)
+        # after restarts the live partition still holds the last hour
+        # and the newest archive the state of the last midnight
+        source = f"{table}_{world}" if period == "hour" else f"{table}_1"
+        self.cursor.execute('SELECT to_regclass(%s);', (source,))
 
-                            if tribe_support_world is None:
-                                tribe_support_world = self.tribe_support[world] = Counter()
+        if self.cursor.fetchone()[0] is None:
+            return None
 
-                            tribe_id = data_pack[id_][2]
-                            tribe_support_world[tribe_id] += int(data_pack[id_][pointer])
+        attributes = parse.gainer_stats[table]
+        query = f'SELECT id, {", ".join(attributes)} FROM {source} WHERE world = %s;'
+        self.cursor.execute(query, (world,))
 
-                    except KeyError:
-                        continue
+        snapshot = cache[(table, world)] = Snapshot.build(self.cursor.fetchall(), attributes)
+        return snapshot
 
-            pointer += 2
+    def layout(self, table):
+        # column names without world and primary key definition
+        return [col.split()[0] for col in getattr(self, f"{table}_create")[1:-1]]
 
-        # not that readable but way faster
-        return [f'{",".join([world, *listed])}' for listed in data_pack.values()]
+    def data_packer(self, table, world):
+        urls = getattr(self, f"{table}_url")
+        columns = self.layout(table)
+        frame = None
+
+        for index, base in enumerate(urls):
+            domain = self.languages[world[:2]]
+            url = base.format(world, domain)
+
+            with self.stats.phase("download", world):
+                cache = self.secure_get(url, world)
+
+            if cache is None or cache.text.startswith("<!DOCTYPE html>"):
+                return self.fallback(table, world)
+
+            self.stats.count("bytes", len(cache.content), world)
+
+            try:
+                with self.stats.phase("parse", world):
+                    # first url everything besides bash data
+                    if index == 0:
+                        frame = ingest.Frame.parse(cache.text, columns, self.strings[table], self.widths[table])
+                    else:
+                        kind = self.kills[table][index - 1]
+                        frame.join(cache.text, f"{kind}_bash", f"{kind}_rank")
+
+            except ValueError:
+                return self.fallback(table, world)
+
+        return frame
+
+    def fallback(self, table, world):
+        self.stats.count("fallbacks", world=world)
+
+        with self.stats.phase("fallback", world):
+            return self.fetch_old_data(table, world)
+
+    def store_summaries(self, world, summaries):
+        for table, columns in summaries.items():
+            values = [col.split()[0] for col in getattr(self, f"{table}_create")[:-1]]
+            columns = [c if isinstance(c, list) else map(str, c.tolist()) for c in columns]
+            # tabs since array literals contain commas
+            data = map("\t".join, zip(repeat(world), *columns))
+            table_name = f"{table}_{world}"
+
+            self.cursor.execute(f'TRUNCATE TABLE {table_name};')
+            self.cursor.copy_from(io.StringIO("\n".join(data)), table_name, columns=values, sep='\t')
+
+    def store_membership(self, world, players):
+        """moves tribe index rows to the tribes of the loaded players, villages follow with the village step"""
+        table_name = f"tribe_index_{world}"
+
+        # a player has a single row, changing its tribe can't collide with another one
+        query = f'UPDATE {table_name} t SET tribe_id = p.tribe_id FROM {players} p ' \
+                f'WHERE p.id = t.player_id AND p.tribe_id <> t.tribe_id;' \
+                f'DELETE FROM {table_name} t WHERE NOT EXISTS (' \
+                f'SELECT 1 FROM {players} p WHERE p.id = t.player_id);' \
+                f'INSERT INTO {table_name} (world, tribe_id, player_id, villages) ' \
+                f'SELECT p.world, p.tribe_id, p.id, \'{{}}\' FROM {players} p WHERE NOT EXISTS (' \
+                f'SELECT 1 FROM {table_name} t WHERE t.player_id = p.id);'
+        self.cursor.execute(query)
 
     def archive(self):
         cur = self.conn.cursor()
@@ -362,100 +924,75 @@ class Cardinal:
             cur.execute(query)
             self.conn.commit()
 
+        # run history shares the retention of the archives
+        query = 'DELETE FROM update_run WHERE started < now() - %s * interval \'1 day\';'
+        cur.execute(query, (self.max_archived_days,))
+        self.conn.commit()
+
     def fetch_old_data(self, table, world):
-        query = f'SELECT * FROM {table} WHERE world = \'{world}\';'
+        columns = self.layout(table)
+        query = f'SELECT {", ".join(columns)} FROM {table} WHERE world = \'{world}\';'
         self.cursor.execute(query)
 
-        old_data = []
-        for row in self.cursor.fetchall():
-            str_row = ",".join([str(e) for e in row])
-            old_data.append(str_row)
-
-        return old_data
+        return ingest.Frame.from_rows(self.cursor.fetchall(), columns, self.strings[table])
 
     # creates base tables if needed
     def setup_tables(self):
         cur = self.conn.cursor()
         base = 'CREATE TABLE IF NOT EXISTS "{}" ({})'
 
-        for table in self.types:
+        for table in (*self.types, *self.summaries):
             empty_query = base + ' PARTITION BY LIST (world)' if table != "world" else base
             values = getattr(self, f"{table}_create")
             query = empty_query.format(table, ",".join(values))
             cur.execute(query)
 
-        self.conn.commit()
-        cur.close()
+        cur.execute(base.format("search", ",".join(self.search_create)))
+        cur.execute(";".join(self.search_indexes))
+        cur.execute(base.format("update_run", ",".join(self.update_run_create)))
+        cur.execute(base.format("world_schedule", ",".join(self.world_schedule_create)))
+        cur.execute(base.format("world_demand", ",".join(self.world_demand_create)))
+        cur.execute(base.format("update_cycle", ",".join(self.update_cycle_create)))
+        cur.execute(base.format("update_job", ",".join(self.update_job_create)))
+        cur.execute(base.format("index_stats", ",".join(self.index_stats_create)))
+        # stats tables of older versions lack the scans of replaced partitions
+        cur.execute('ALTER TABLE index_stats ADD COLUMN IF NOT EXISTS scans BIGINT DEFAULT 0')
 
-    # creates a cache table with base table columns
-    def create_temp(self, table):
-        base = 'DROP TABLE IF EXISTS "cache";' \
-               'CREATE TABLE "cache" ({});'
-        values = getattr(self, f"{table}_create")
-        query = base.format(",".join(values))
-        self.cursor.execute(query)
         self.conn.commit()
-        return values
+        cur.close()
 
     # refresh valid worlds
     def update_worlds(self, date):
         cur = self.conn.cursor()
         cur.execute('SELECT world FROM world')
-        old_worlds = [row[0] for row in cur.fetchall()]
-
-        worlds = []
-        for world_key, lang in self.languages.items():
-            base = "https://{}/backend/get_servers.php"
-            content = self.session.get(base.format(lang))
-            matches = re.findall(r'([a-z]{2}([a-z])?\d+)', content.text)
-
-            if not matches:
-                continue
-
-            elif content.text.startswith("<!DOCTYPE html>"):
-                return None
-
-            current_worlds = {k: v for k, v in matches}
-
-            for world, world_type in current_worlds.items():
-                # ignoring speed servers
-                if world_type == "s":
-                    continue
-                else:
-                    worlds.append(world)
-
-                    # creating partitions of worlds
-                    queries = []
-                    for table in self.types[:-1]:
-                        query = f'CREATE TABLE IF NOT EXISTS {table}_{world} ' \
-                                f'PARTITION OF {table} FOR VALUES IN (\'{world}\');'
-                        queries.append(query)
+        old_worlds = {row[0] for row in cur.fetchall()}
 
-                    cur.execute("".join(queries))
+        # every language and config is its own host, so they are fetched side by side
+        with ThreadPoolExecutor(self.discovery_workers) as executor:
+            listings = list(executor.map(self.fetch_servers, self.languages.values()))
+            failed = [lang for lang, listing in zip(self.languages, listings) if listing is None]
 
-                # config loads only for new worlds and at 12AM
-                if world in old_worlds and date.hour != 0:
-                    continue
-
-                base = "https://{}.{}/interface.php?func=get_config"
-                cache = self.secure_get(base.format(world, lang))
+            # a missing listing is no empty one, its worlds would be dropped as dead
+            if failed:
+                raise ValueError(f"server list of {', '.join(failed)} failed, keeping {len(old_worlds)} worlds")
 
-                if cache is None:
-                    continue
+            worlds = [world for listing in listings for world in listing]
 
-                parsed_xml = xmltodict.parse(cache.text, dict_constructor=dict)
-                world_config = parsed_xml['config']
-                imp = world_config.pop('speed'), world_config.pop('unit_speed'), world_config.pop('moral')
-                batch = [world, *[float(n) for n in imp], json.dumps(world_config)]
+            # config loads only for new worlds and at 12AM
+            targets = [world for world in worlds if world not in old_worlds or date.hour == 0]
+            configs = [batch for batch in executor.map(self.fetch_config, targets) if batch is not None]
 
-                query = 'INSERT INTO world (world, speed, unit_speed, moral, config) ' \
-                        'VALUES (%s, %s, %s, %s, %s) ON CONFLICT (world) DO UPDATE SET ' \
-                        'speed = EXCLUDED.speed, unit_speed = EXCLUDED.unit_speed, ' \
-                        'moral = EXCLUDED.moral, config = EXCLUDED.config'
+        created = self.create_partitions(cur, worlds)
+        self.stats.count("partitions", created)
 
-                cur.execute(query, batch)
+        query = 'INSERT INTO world (world, speed, unit_speed, moral, config) VALUES %s ' \
+                'ON CONFLICT (world) DO UPDATE SET ' \
+                'speed = EXCLUDED.speed, unit_speed = EXCLUDED.unit_speed, ' \
+                'moral = EXCLUDED.moral, config = EXCLUDED.config'
+        execute_values(cur, query, configs)
+        self.stats.count("configs", len(configs))
 
-        dead_worlds = tuple(set(old_worlds) - set(worlds))
+        dead_worlds = tuple(old_worlds - set(worlds))
         if dead_worlds:
             for dead_world in dead_worlds:
                 self.cleanup_dead_world(cur, dead_world)
@@ -466,12 +1003,78 @@ class Cardinal:
         self.conn.commit()
         return worlds
 
+    def fetch_servers(self, lang):
+        """non speed worlds of one language, None if the server list failed or is an error page"""
+        base = f"{self.server_url}/backend/get_servers.php"
+        content = self.secure_get(base.format(lang))
+
+        if content is None:
+            return None
+
+        matches = re.findall(r'([a-z]{2}([a-z])?\d+)', content.text)
+
+        # an unreadable list tells nothing about which worlds are gone
+        if not matches or content.text.startswith("<!DOCTYPE html>"):
+            return None
+
+        # ignoring speed servers
+        return [world for world, world_type in dict(matches).items() if world_type != "s"]
+
+    def fetch_config(self, world):
+        base = f"{self.world_url}/interface.php?func=get_config"
+
+        with self.stats.phase("config", world):
+            cache = self.secure_get(base.format(world, self.languages[world[:2]]), world)
+
+        if cache is None:
+            return None
+
+        parsed_xml = xmltodict.parse(cache.text, dict_constructor=dict)
+        world_config = parsed_xml['config']
+        imp = world_config.pop('speed'), world_config.pop('unit_speed'), world_config.pop('moral')
+        return world, *[float(n) for n in imp], json.dumps(world_config)
+
+    def create_partitions(self, cursor, worlds):
+        """creates missing partitions and their missing indexes, known worlds cost a single catalog lookup"""
+        tables = (*self.types[:-1], *self.summaries)
+        names = {f"{table}_{world}": (table, world) for world in worlds for table in tables}
+        indexes = [name for table, world in names.values() for name in self.indexes.names(table, world)]
+
+        cursor.execute('SELECT relname FROM pg_class WHERE relname = ANY(%s);', ([*names, *indexes],))
+        existing = {row[0] for row in cursor.fetchall()}
+
+        partitions, queries = 0, []
+        for name, (table, world) in names.items():
+            if name not in existing:
+                partitions += 1
+                queries.append(f'CREATE TABLE IF NOT EXISTS {name} '
+                               f'PARTITION OF {table} FOR VALUES IN (\'{world}\');')
+
+            # also covers indexes declared after their partition was created
+            queries.extend(self.indexes.create(table, world, existing))
+
+        if queries:
+            cursor.execute("".join(queries))
+
+        return partitions
+
     def cleanup_dead_world(self, cursor, dead_world):
-        for table in self.types[:-1]:
+        for table in (*self.types[:-1], *self.summaries):
             query = f'''DROP TABLE IF EXISTS {table}_{dead_world};
             DELETE FROM world WHERE world = \'{dead_world}\';'''
             cursor.execute(query)
 
+            self.snapshots.pop((table, dead_world), None)
+            self.snapshot_taken.pop((table, dead_world), None)
+            self.daily_snapshots.pop((table, dead_world), None)
+
+        cursor.execute('DELETE FROM search WHERE world = %s;', (dead_world,))
+        cursor.execute('DELETE FROM world_schedule WHERE world = %s;', (dead_world,))
+        cursor.execute('DELETE FROM index_stats WHERE world = %s;', (dead_world,))
+
+        if self.snapshot_path is not None:
+            remove_world(self.snapshot_path, dead_world)
+
     def send_code(self, code):
         try:
             query = f"NOTIFY log, '{code}'"
@@ -482,27 +1085,52 @@ class Cardinal:
             print(f"EXCEPTION OCCURRED NOTIFYING {e}")
             traceback.print_exc()
 
-    def secure_get(self, url):
-        for _ in range(3):
+    def send_update(self, table, world, frame):
+        # sent after commit and publish, clients reacting to it already see the new data
+        event = {'world': world, 'table': table, 'version': self.cycle.isoformat(), 'rows': len(frame)}
+        event.update(self.changes.pop((table, world), {}))
+
+        try:
+            cur = self.res.cursor()
+            cur.execute("SELECT pg_notify('world_update', %s)", (json.dumps(event),))
+            self.res.commit()
+        except Exception as e:
+            print(f"EXCEPTION OCCURRED NOTIFYING {e}")
+            traceback.print_exc()
+
+    def secure_get(self, url, world=None):
+        for attempt in range(3):
+            if attempt:
+                self.stats.count("retries", world=world)
+
             try:
-                return self.session.get(url)
-            except ConnectionError:
-                self.session = requests.Session()
-                time.sleep(.15)
+                response = self.transport.get(url)
+
+                if response.status_code == 200:
+                    return response
+
+                # only server errors are worth another try
+                elif response.status_code < 500:
+                    return None
+
+            except requests.exceptions.RequestException:
+                self.transport.reset()
+
+            time.sleep(.15 * (attempt + 1))
 
+        self.stats.count("failed_requests", world=world)
         return None
 
-    @staticmethod
-    def get_seconds_till_hour():
-        now = datetime.datetime.now()
-        clean = now + datetime.timedelta(hours=1)
-        goal_time = clean.replace(minute=0, second=0, microsecond=0)
+    def get_seconds_till_tick(self, now=None):
+        now = now or datetime.datetime.now()
+        goal_time = self.scheduler.floor(now) + datetime.timedelta(minutes=self.scheduler.tick)
         start_time = now.replace(microsecond=0)
         goal = (goal_time - start_time).seconds
         return goal
 
     def manual_run(self, archive=False, send_code=False):
         start = datetime.datetime.now()
+        self.stats = RunStats()
 
         try:
             self.worlds = self.update_worlds(start)
@@ -524,11 +1152,14 @@ class Cardinal:
             return
 
         if archive:
-            self.archive()
+            with self.stats.phase("archive"):
+                self.archive()
 
         end = datetime.datetime.now()
         current = datetime.datetime.strftime(end, "%H:%M")
         print(f"{current} | Updated {len(self.worlds)} worlds in {end - start}")
+        print(f"{current} | {self.stats.summary()}")
+        self.record_run(True)
 
     def manual_cleanup(self):
         start = datetime.datetime.now()
@@ -562,5 +1193,35 @@ class Cardinal:
         cur.close()
 
 
-cardinal = Cardinal()
-cardinal.run()
+def escape_copy(value):
+    # copy text format treats backslashes, tabs and newlines specially
+    return value.replace("\\", "\\\\").replace("\t", "\\t").replace("\n", "\\n").replace("\r", "\\r")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="hourly tribal wars data updater")
+    parser.add_argument("--world-url", default="https://{}.{}", help="formatted with world and domain")
+    parser.add_argument("--server-url", default="https://{}", help="formatted with domain")
+    parser.add_argument("--language", nargs="*", default=[], metavar="CODE=DOMAIN",
+                        help="replaces the known languages, e.g. zz=bench for a replay server")
+    parser.add_argument("--worker", nargs="?", const=f"{socket.gethostname()}:{os.getpid()}", metavar="NAME",
+                        help="takes jobs from the shared work queue instead of updating every world alone")
+    parser.add_argument("--lease", type=int, default=900, help="seconds until a job of a dead worker is reclaimed")
+    parser.add_argument("--budget", type=int, help="map fetches per hour, defaults to updating every world hourly")
+    parser.add_argument("--tick", type=int, default=15, help="minutes between two scheduling rounds")
+    args = parser.parse_args()
+
+    if args.budget is not None and args.budget <= 0:
+        parser.error("--budget has to be positive")
+
+    cardinal = Cardinal(args.world_url, args.server_url)
+    cardinal.scheduler.budget = args.budget
+    cardinal.scheduler.tick = cardinal.scheduler.shortest = args.tick
+
+    if args.language:
+        cardinal.languages = dict(pair.split("=", 1) for pair in args.language)
+
+    if args.worker:
+        cardinal.run_worker(args.worker, args.lease)
+    else:
+        cardinal.run()
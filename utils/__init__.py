@@ -1,5 +1,7 @@
 from .database import *
+from .metrics import *
 from .error import *
 from .config import *
 from .parse import *
 from .model import *
+from .travel import *
@@ -1,58 +1,344 @@
+from utils.stream import Broadcaster, parse_event
 import utils
 import asyncpg
+import asyncio
+import time
+
+# named pools and the workloads they serve, replaced by config.pools
+default_pools = {
+    # point lookups keep their own connections while world dumps queue up
+    'point': {'workloads': ('point', 'write'), 'min_size': 4, 'max_size': 10, 'timeout': 10},
+    'bulk': {'workloads': ('bulk',), 'min_size': 1, 'max_size': 4, 'timeout': 60}
+}
+
+# errors after which another pool may still answer
+connection_errors = (
+    OSError,
+    asyncpg.exceptions.InterfaceError,
+    asyncpg.exceptions.PostgresConnectionError,
+    asyncpg.exceptions.CannotConnectNowError
+)
+
+
+class Pool:
+    """one named asyncpg pool with its own size, timeout and health"""
+
+    def __init__(self, name, workloads=('point', 'bulk', 'write'), min_size=2, max_size=10, timeout=10, **kwargs):
+        self.name = name
+        self.workloads = tuple(workloads)
+        self.min_size = min_size
+        self.max_size = max_size
+        self.timeout = timeout
+
+        # host, port and the like override the shared connection settings
+        self.kwargs = {**utils.conn_kwargs, **kwargs}
+        self.pool = None
+        self.healthy = False
+        self.waiting = 0
+
+    async def connect(self):
+        self.pool = await asyncpg.create_pool(
+            min_size=self.min_size, max_size=self.max_size, command_timeout=self.timeout, **self.kwargs)
+        self.healthy = True
+
+    async def acquire(self):
+        self.waiting += 1
+
+        try:
+            return await self.pool.acquire(timeout=self.timeout)
+        finally:
+            self.waiting -= 1
+
+    async def check(self):
+        # own connection, a pool busy with dumps is not an unhealthy one
+        try:
+            conn = await asyncio.wait_for(asyncpg.connect(**self.kwargs), self.timeout)
+
+            try:
+                await conn.fetchval('SELECT 1', timeout=self.timeout)
+            finally:
+                await conn.close()
+
+            if self.pool is None:
+                await self.connect()
+
+            if not self.healthy:
+                print(f"Pool {self.name} is healthy again")
+
+            self.healthy = True
+
+        except (*connection_errors, asyncio.TimeoutError) as error:
+            if self.healthy:
+                print(f"Pool {self.name} is unhealthy: {error}")
+
+            self.healthy = False
+
+    async def close(self):
+        if self.pool is not None:
+            await self.pool.close()
 
 
 class Database:
     def __init__(self):
-        self._pool = None
+        options = getattr(utils.config, 'pools', default_pools)
+        self.pools = [Pool(name, **settings) for name, settings in options.items()]
+        self._listener = None
         self._conn = None
+        self._health = None
+        self.inflight = {}
+        self.flushed = {}
+
+        # tables mapped from the files of the updater, shared by every worker
+        path = getattr(utils.config, 'snapshot_path', None)
+        self.mapped = None
+
+        # numpy only gets imported if there is something to map
+        if path:
+            from utils.mapped import MappedStore
+            self.mapped = MappedStore(path)
+
+        self.ready = False
+        self.warm_error = None
+        self.broadcaster = Broadcaster()
         self.worlds = []
         self.languages = []
 
     async def connect(self):
-        self._pool = await asyncpg.create_pool(**utils.conn_kwargs) # type: ignore
+        # notifications only reach the primary, which has to be up
+        self._listener = self.route('write')[0]
+
+        for pool in self.pools:
+            try:
+                await pool.connect()
+            except connection_errors as error:
+                if pool is self._listener:
+                    raise
+
+                print(f"Pool {pool.name} failed to connect: {error}")
 
         await self.update_worlds()
+        self.reload_mapped()
 
         # initiate logging connection for discord callback
-        self._conn = await self._pool.acquire()
+        self._conn = await self._listener.pool.acquire()
         await self._conn.add_listener('log', self.callback)
+        await self._conn.add_listener('world_update', self.update_callback)
+        self._health = asyncio.create_task(self.check_health())
 
     async def disconnect(self):
-        self._conn.remove_listener('log', self.callback)
-        self._pool.release(self._conn)
-        await self._pool.close()
+        self._health.cancel()
+        await self._conn.remove_listener('log', self.callback)
+        await self._conn.remove_listener('world_update', self.update_callback)
+        await self._listener.pool.release(self._conn)
+
+        for pool in self.pools:
+            await pool.close()
+
+    async def check_health(self, seconds=10):
+        while True:
+            await asyncio.sleep(seconds)
+            await asyncio.gather(*(pool.check() for pool in self.pools))
 
     def verify_world(self, world):
         if world not in self.worlds:
             raise utils.error.InvalidWorld()
 
-    async def fetch(self, query, *args, key=None, with_world=False):
-        async with self._pool.acquire() as conn:
-            response = await conn.fetch(query, *args)
-            batch = [dict(row) for row in response]
+    def route(self, workload):
+        """pools to try for given workload, healthy ones first and in configured order"""
+        pools = [pool for pool in self.pools if workload in pool.workloads]
+
+        # reads fail over to any pool, writes only to the ones meant for them
+        if workload != 'write':
+            pools.extend(pool for pool in self.pools if pool not in pools)
+
+        return sorted(pools, key=lambda pool: not pool.healthy)
+
+    async def run(self, workload, method, query, *args):
+        """returns result, pool name, wait and query seconds of the first pool able to answer"""
+        failure = None
+
+        for pool in self.route(workload):
+            if pool.pool is None:
+                continue
+
+            start = time.perf_counter()
+
+            try:
+                conn = await pool.acquire()
+            except asyncio.TimeoutError as error:
+                # saturated, the next pool may have a free connection
+                failure = error
+                continue
+            except connection_errors as error:
+                pool.healthy, failure = False, error
+                continue
+
+            acquired = time.perf_counter()
+
+            try:
+                result = await getattr(conn, method)(query, *args)
+            except connection_errors as error:
+                pool.healthy, failure = False, error
+                continue
+            finally:
+                await pool.pool.release(conn)
+
+            wait, spent = acquired - start, time.perf_counter() - acquired
+            utils.metrics.observe_call(method, pool.name, wait, spent)
+            return result, pool.name, wait, spent
+
+        raise failure or asyncpg.exceptions.InterfaceError("no pool available")
+
+    async def shared(self, workload, method, query, *args):
+        """identical concurrent queries share one call, records are immutable so every caller can convert them"""
+        key = (workload, method, query, args)
+
+        try:
+            task = self.inflight.get(key)
+        except TypeError:
+            # unhashable arguments like lists run on their own
+            return await self.run(workload, method, query, *args)
+
+        if task is None:
+            task = self.inflight[key] = asyncio.ensure_future(self.run(workload, method, query, *args))
+            task.add_done_callback(lambda _: self.inflight.pop(key, None))
+        else:
+            utils.metrics.coalesced_queries.inc(method)
+
+        # a cancelled caller doesn't cancel the query of the others
+        return await asyncio.shield(task)
+
+    async def fetch(self, query, *args, key=None, with_world=False, workload='point'):
+        response, _, wait, spent = await self.shared(workload, 'fetch', query, *args)
+        converting = time.perf_counter()
+        batch = [dict(row) for row in response]
+
+        if not with_world:
+            [row.pop('world', None) for row in batch]
+
+        if key is not None:
+            batch = {row.pop(key): row for row in batch}
+
+        utils.metrics.observe_query('fetch', wait, spent, time.perf_counter() - converting)
+        return batch
+
+    async def fetchone(self, query, *args, with_world=False, workload='point'):
+        response, _, wait, spent = await self.shared(workload, 'fetchrow', query, *args)
+        converting = time.perf_counter()
+        result = None
+
+        if response is not None:
+            result = dict(response)
 
             if not with_world:
-                [row.pop('world') for row in batch]
+                result.pop('world', None)
+
+        utils.metrics.observe_query('fetchone', wait, spent, time.perf_counter() - converting)
+        return result
 
-            if key is not None:
-                return {row.pop(key): row for row in batch}
-            else:
-                return batch
+    def report_pool(self):
+        metrics = utils.metrics
 
-    async def fetchone(self, query, *args, with_world=False):
-        async with self._pool.acquire() as conn:
-            response = await conn.fetchrow(query, *args)
+        for pool in self.pools:
+            metrics.pool_healthy.set(int(pool.healthy), pool.name)
 
-            if response is not None:
-                result = dict(response)
+            if pool.pool is None:
+                continue
 
-                if not with_world:
-                    result.pop('world')
+            size, idle = pool.pool.get_size(), pool.pool.get_idle_size()
+            metrics.pool_connections.set(size, pool.name, 'open')
+            metrics.pool_connections.set(idle, pool.name, 'idle')
+            metrics.pool_connections.set(size - idle, pool.name, 'busy')
+            metrics.pool_connections.set(pool.pool.get_max_size(), pool.name, 'max')
+            metrics.pool_connections.set(pool.waiting, pool.name, 'waiting')
+
+    async def flush_demand(self):
+        """adds the requests per world since the last flush to the demand of the updater"""
+        totals = {}
+        for (_, world), amount in utils.metrics.world_requests.values.items():
+            if world in self.worlds:
+                totals[world] = totals.get(world, 0) + amount
+
+        batch = [(world, amount - self.flushed.get(world, 0)) for world, amount in totals.items()]
+        batch = [entry for entry in batch if entry[1] > 0]
+
+        if batch:
+            query = 'INSERT INTO world_demand (world, hour, requests) ' \
+                    'VALUES ($1, date_trunc(\'hour\', now()), $2) ON CONFLICT (world, hour) ' \
+                    'DO UPDATE SET requests = world_demand.requests + EXCLUDED.requests'
+            await self.run('write', 'executemany', query, batch)
+
+        self.flushed = totals
+
+    def reload_mapped(self):
+        if self.mapped is None:
+            return
+
+        try:
+            self.mapped.reload()
+        except OSError as error:
+            print(f"Mapped Reload Error: {error}")
+
+    def refresh_mapped(self, table, world):
+        if self.mapped is None:
+            return
+
+        try:
+            self.mapped.refresh(table, world)
+        except (OSError, ValueError) as error:
+            print(f"Mapped Refresh Error: {error}")
 
-                return result
+    def mapped_table(self, table, world):
+        """returns the mapped table of given world or None if the database has to answer"""
+        self.verify_world(world)
+
+        if self.mapped is None:
             return None
 
+        result = self.mapped.get(table, world)
+        utils.metrics.mapped_lookups.inc(table, "miss" if result is None else "hit")
+        return result
+
+    async def hot_worlds(self, amount):
+        """most requested worlds of the last day, from the demand flushed by every worker"""
+        query = 'SELECT world FROM world_demand WHERE hour > now()::timestamp - interval \'1 day\' ' \
+                'GROUP BY world ORDER BY sum(requests) DESC LIMIT $1'
+        response = await self.fetch(query, amount, with_world=True)
+        return [row['world'] for row in response if row['world'] in self.worlds]
+
+    async def warm(self, world, queries):
+        """reads mapped tables ahead, the other partitions run the point queries of the api"""
+        for table, statements in queries.items():
+            mapped = self.mapped.get(table, world) if self.mapped is not None else None
+
+            if mapped is not None:
+                mapped.warm()
+                continue
+
+            for query, *args in statements:
+                await self.fetch(self.create_query(table, query, world), *args)
+
+    async def warm_up(self, queries, amount=20, concurrency=4):
+        """warms the hot worlds side by side, at most concurrency at once, ready only once all of them are"""
+        start = time.perf_counter()
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def bounded(world):
+            async with semaphore:
+                await self.warm(world, queries)
+
+        worlds = await self.hot_worlds(amount) if amount else []
+        results = await asyncio.gather(*(bounded(world) for world in worlds), return_exceptions=True)
+
+        for result in results:
+            if isinstance(result, Exception):
+                raise result
+
+        self.ready = True
+        self.warm_error = None
+        utils.metrics.warm_seconds.set(time.perf_counter() - start)
+        return worlds
+
     def create_query(self, table_types, query, world_id, *extra_args):
         if world_id not in self.worlds:
             raise utils.error.InvalidWorld()
@@ -68,14 +354,36 @@ class Database:
 
         if payload == "200":
             await self.update_worlds()
+            self.reload_mapped()
         else:
             print(args)
 
+    async def update_callback(self, *args):
+        event = parse_event(args[-1])
+
+        if event is None:
+            print(args)
+            return
+
+        # first update of a new world arrives before the 200 of its cycle
+        if event['world'] not in self.worlds:
+            await self.update_worlds()
+
+        # clients reacting to the event have to see the new data already
+        self.refresh_mapped(event['table'], event['world'])
+        utils.metrics.stream_events.inc(event['table'])
+        self.broadcaster.publish(event)
+
     async def update_worlds(self):
         try:
             response = await self.fetch('SELECT world FROM world', with_world=True)
 
-            self.worlds = [e['world'] for e in response]
+            worlds = [e['world'] for e in response]
+
+            for world in set(self.worlds) - set(worlds):
+                self.broadcaster.forget(world)
+
+            self.worlds = worlds
             self.languages = [w[:2] for w in self.worlds]
 
         except asyncpg.exceptions.InterfaceError:
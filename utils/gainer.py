@@ -0,0 +1,62 @@
+import numpy as np
+
+
+class Snapshot:
+    """per entity stats of one world, sorted by id"""
+    __slots__ = ('ids', 'stats', 'attributes')
+
+    def __init__(self, ids, stats, attributes):
+        self.ids = ids
+        self.stats = stats
+        self.attributes = attributes
+
+    def __len__(self):
+        return len(self.ids)
+
+    @classmethod
+    def build(cls, records, attributes):
+        # records are (id, *stats) as strings or ints
+        data = np.array(records).astype(np.int64).reshape(-1, len(attributes) + 1)
+        order = np.argsort(data[:, 0], kind='stable')
+        data = data[order]
+        return cls(data[:, 0].copy(), data[:, 1:].copy(), tuple(attributes))
+
+    def diff(self, previous):
+        """returns ids and stat deltas of entities present in both snapshots"""
+        if not len(previous) or not len(self):
+            return self.ids[:0], self.stats[:0]
+
+        positions = np.searchsorted(previous.ids, self.ids)
+        positions[positions == len(previous.ids)] = 0
+        found = previous.ids[positions] == self.ids
+        return self.ids[found], self.stats[found] - previous.stats[positions[found]]
+
+    def changes(self, previous):
+        """counts of entities which moved, appeared and vanished since previous"""
+        ids, deltas = self.diff(previous)
+        return {'changed': int(np.count_nonzero(deltas.any(axis=1))),
+                'added': len(self) - len(ids), 'removed': len(previous) - len(ids)}
+
+    def changed(self, previous):
+        """share of entities which moved, appeared or vanished since previous"""
+        size = max(len(self), len(previous), 1)
+        return sum(self.changes(previous).values()) / size
+
+    def rank(self, previous, limit=500):
+        """yields attribute, order, ids and deltas of the biggest movers"""
+        ids, deltas = self.diff(previous)
+
+        for index, attribute in enumerate(self.attributes):
+            column = deltas[:, index]
+
+            descending = np.argsort(-column, kind='stable')
+            gainers = descending[column[descending] > 0][:limit]
+            yield attribute, 'DESC', ids[gainers], column[gainers]
+
+            ascending = np.argsort(column, kind='stable')
+            losers = ascending[column[ascending] < 0][:limit]
+            yield attribute, 'ASC', ids[losers], column[losers]
+
+
+def array_literal(values):
+    return f'{{{",".join(map(str, values.tolist()))}}}'
@@ -0,0 +1,72 @@
+# indexes of every world partition besides the primary key, name -> definition
+partition_indexes = {
+    'village': {
+        'player_id': "(player_id)"
+    },
+    'player': {
+        'tribe_id': "(tribe_id)",
+        'name': "(LOWER(name))",
+        # ranking columns of the top endpoints, scanned backwards for DESC
+        'villages': "(villages)",
+        'points': "(points)",
+        'att_bash': "(att_bash)",
+        'def_bash': "(def_bash)",
+        'sup_bash': "(sup_bash)",
+        'all_bash': "(all_bash)"
+    },
+    'tribe': {
+        'name': "(LOWER(name))",
+        'tag': "(LOWER(tag))",
+        'member': "(member)",
+        'villages': "(villages)",
+        'points': "(points)",
+        'all_points': "(all_points)",
+        'att_bash': "(att_bash)",
+        'def_bash': "(def_bash)",
+        'sup_bash': "(sup_bash)",
+        'all_bash': "(all_bash)"
+    }
+}
+
+
+class IndexManager:
+    """declared indexes of the world partitions
+
+    every swap builds them on the loaded staging table of a partition,
+    the swap itself only renames them along with the table
+    """
+
+    def __init__(self, declared=None):
+        self.declared = partition_indexes if declared is None else declared
+
+    def names(self, table, world):
+        return {f"{table}_{world}_{key}": definition for key, definition in self.declared.get(table, {}).items()}
+
+    def create(self, table, world, existing=()):
+        """statements creating the declared indexes of a partition which are not in existing"""
+        partition = f"{table}_{world}"
+        return [f'CREATE INDEX IF NOT EXISTS {name} ON {partition} {definition};'
+                for name, definition in self.names(table, world).items() if name not in existing]
+
+    def build(self, table, world):
+        """statements building the declared indexes on the staging table of a partition"""
+        staging = f"{table}_{world}_next"
+        return [f'CREATE INDEX {name}_next ON {staging} {definition};'
+                for name, definition in self.names(table, world).items()]
+
+    def rename(self, table, world):
+        # the replaced partition has to be dropped first, its indexes hold the names
+        return [f'ALTER INDEX {name}_next RENAME TO {name};' for name in self.names(table, world)]
+
+    def keep_scans(self, cursor, table, world):
+        """adds the scans of the partition about to be replaced, its statistics go with it"""
+        query = 'UPDATE index_stats s SET scans = s.scans + i.idx_scan FROM pg_stat_user_indexes i ' \
+                'WHERE s.world = %s AND s.ds_type = %s AND i.relname = %s AND i.indexrelname = s.name'
+        cursor.execute(query, (world, table, f"{table}_{world}"))
+
+    def record_size(self, cursor, table, world):
+        query = 'INSERT INTO index_stats (world, ds_type, name, size, measured) ' \
+                'SELECT %s, %s, indexrelname, pg_relation_size(indexrelid), now() FROM pg_stat_user_indexes ' \
+                'WHERE relname = %s AND indexrelname = ANY(%s) ' \
+                'ON CONFLICT (world, ds_type, name) DO UPDATE SET size = EXCLUDED.size, measured = EXCLUDED.measured'
+        cursor.execute(query, (world, table, f"{table}_{world}", list(self.names(table, world))))
@@ -0,0 +1,219 @@
+from itertools import repeat
+import numpy as np
+
+
+def tokenize(text, width):
+    """splits map file text into a (rows, width) object array"""
+    body = text.strip('\n')
+
+    if not body:
+        return np.empty((0, width), dtype=object)
+
+    # commas per line, a cut or malformed file fails as a whole so loads keep the previous data
+    data = np.frombuffer(body.encode(), dtype=np.uint8)
+    commas = np.cumsum(data == ord(','))
+    ends = np.append(np.flatnonzero(data == ord('\n')), len(data) - 1)
+
+    if np.any(np.diff(commas[ends], prepend=0) != width - 1):
+        raise ValueError("malformed line")
+
+    tokens = body.replace('\n', ',').split(',')
+    return np.array(tokens, dtype=object).reshape(-1, width)
+
+
+def to_int(tokens):
+    """parses an object array of number strings in a single C pass"""
+    if not tokens.size:
+        return np.zeros(tokens.shape, dtype=np.int64)
+
+    flat = ",".join(tokens.ravel().tolist())
+    values = np.fromstring(flat, dtype=np.int64, sep=',')
+
+    if values.size != tokens.size:
+        raise ValueError("malformed numeric column")
+
+    return values.reshape(tokens.shape)
+
+
+def first_of_group(*keys):
+    """flags the first row of each run of equal keys in sorted arrays"""
+    size = len(keys[0])
+    first = np.ones(size, dtype=bool)
+
+    if size > 1:
+        change = np.zeros(size - 1, dtype=bool)
+        for key in keys:
+            change |= key[1:] != key[:-1]
+
+        first[1:] = change
+
+    return first
+
+
+class Frame:
+    """one table of one world as an id sorted numeric matrix plus string columns"""
+    __slots__ = ('columns', 'numbers', 'strings', 'index')
+
+    def __init__(self, columns, numbers, strings):
+        self.columns = columns
+        self.numbers = numbers
+        self.strings = strings
+
+        numeric = [c for c in columns if c not in strings]
+        self.index = {column: index for index, column in enumerate(numeric)}
+
+    def __len__(self):
+        return len(self.numbers)
+
+    def column(self, name):
+        return self.numbers[:, self.index[name]]
+
+    @property
+    def ids(self):
+        return self.column('id')
+
+    @classmethod
+    def parse(cls, text, columns, strings, width):
+        """base map files hold the first width columns, everything else starts at 0"""
+        tokens = tokenize(text, width)
+        numeric = [i for i, column in enumerate(columns[:width]) if column not in strings]
+
+        numbers = np.zeros((len(tokens), len(columns) - len(strings)), dtype=np.int64)
+        numbers[:, :len(numeric)] = to_int(tokens[:, numeric])
+
+        order = np.argsort(numbers[:, 0], kind='stable')
+        string_columns = {c: tokens[order, columns.index(c)] for c in strings}
+        return cls(columns, numbers[order], string_columns)
+
+    @classmethod
+    def from_rows(cls, rows, columns, strings):
+        data = np.array(rows, dtype=object).reshape(-1, len(columns))
+        numeric = [i for i, column in enumerate(columns) if column not in strings]
+
+        numbers = data[:, numeric].astype(np.int64)
+        order = np.argsort(numbers[:, 0], kind='stable')
+        string_columns = {c: data[order, columns.index(c)] for c in strings}
+        return cls(columns, numbers[order], string_columns)
+
+    def locate(self, ids):
+        """returns positions of given ids in this frame and which of them exist"""
+        own_ids = self.ids
+
+        if not len(own_ids):
+            return np.zeros(len(ids), dtype=np.intp), np.zeros(len(ids), dtype=bool)
+
+        positions = np.searchsorted(own_ids, ids)
+        positions[positions == len(own_ids)] = 0
+        return positions, own_ids[positions] == ids
+
+    def join(self, text, bash, rank):
+        """writes a kill file (rank, id, points) into the given columns"""
+        kills = to_int(tokenize(text, 3))
+        positions, found = self.locate(kills[:, 1])
+
+        self.numbers[positions[found], self.index[bash]] = kills[found, 2]
+        self.numbers[positions[found], self.index[rank]] = kills[found, 0]
+
+    def to_copy(self, world, sep=','):
+        columns = []
+        for column in self.columns:
+            if column in self.strings:
+                columns.append(self.strings[column].tolist())
+            else:
+                columns.append(map(str, self.column(column).tolist()))
+
+        return "\n".join(map(sep.join, zip(repeat(world, len(self)), *columns)))
+
+
+def support_ranks(tribes, players):
+    """sums player support per tribe, rank 0 equals no support at all"""
+    positions, found = tribes.locate(players.column('tribe_id'))
+    weights = players.column('sup_bash')[found]
+    support = np.bincount(positions[found], weights=weights, minlength=len(tribes))
+    support = support.astype(np.int64)
+
+    ranks = np.empty(len(tribes), dtype=np.int64)
+    ranks[np.argsort(-support, kind='stable')] = np.arange(1, len(tribes) + 1)
+    ranks[support == 0] = 0
+    return support, ranks
+
+
+def summarize(villages, players):
+    """continent, tribe continent, tribe area and tribe index columns of one world"""
+    x, y = villages.column('x'), villages.column('y')
+    owners, points = villages.column('player_id'), villages.column('points')
+
+    # K55 equals x 500-599 and y 500-599
+    continents = y // 100 * 10 + x // 100
+
+    tribes = np.zeros(len(villages), dtype=np.int64)
+    positions, found = players.locate(owners)
+    tribes[found] = players.column('tribe_id')[positions[found]]
+
+    keys, inverse = np.unique(continents, return_inverse=True)
+    size = len(keys)
+
+    def distinct(values, mask):
+        order = np.lexsort((values[mask], inverse[mask]))
+        groups, members = inverse[mask][order], values[mask][order]
+        return np.bincount(groups[first_of_group(groups, members)], minlength=size)
+
+    continent = [
+        keys,
+        np.bincount(inverse, minlength=size),
+        np.bincount(inverse, weights=owners == 0, minlength=size).astype(np.int64),
+        distinct(owners, owners != 0),
+        distinct(tribes, tribes != 0),
+        np.bincount(inverse, weights=points, minlength=size).astype(np.int64)
+    ]
+
+    # everything below only covers villages of tribe members
+    member = tribes != 0
+    order = np.lexsort((continents[member], tribes[member]))
+    t_tribes, t_continents = tribes[member][order], continents[member][order]
+    t_points, t_x, t_y = points[member][order], x[member][order], y[member][order]
+
+    first = first_of_group(t_tribes, t_continents)
+    groups = np.cumsum(first) - 1
+    tribe_continent = [
+        t_tribes[first],
+        t_continents[first],
+        np.bincount(groups),
+        np.bincount(groups, weights=t_points).astype(np.int64)
+    ]
+
+    starts = np.flatnonzero(first_of_group(t_tribes))
+    counts = np.diff(np.append(starts, len(t_tribes)))
+    tribe_area = [np.empty(0, dtype=np.int64)] * 9
+
+    if len(starts):
+        tribe_area = [
+            t_tribes[starts],
+            counts,
+            np.add.reduceat(t_points, starts),
+            np.minimum.reduceat(t_x, starts),
+            np.minimum.reduceat(t_y, starts),
+            np.maximum.reduceat(t_x, starts),
+            np.maximum.reduceat(t_y, starts),
+            np.round(np.add.reduceat(t_x, starts) / counts, 2),
+            np.round(np.add.reduceat(t_y, starts) / counts, 2)
+        ]
+
+    # village ids of every player, including the ones without villages
+    owned = positions[found]
+    village_ids = villages.ids[found][np.argsort(owned, kind='stable')]
+    bounds = np.cumsum(np.bincount(owned, minlength=len(players)))[:-1]
+    literals = [f'{{{",".join(map(str, chunk.tolist()))}}}' for chunk in np.split(village_ids, bounds)]
+
+    tribe_index = [
+        players.column('tribe_id'),
+        players.ids,
+        literals if len(players) else []
+    ]
+
+    return {
+        'continent': continent,
+        'tribe_continent': tribe_continent,
+        'tribe_area': tribe_area,
+        'tribe_index': tribe_index
+    }
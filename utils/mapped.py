@@ -0,0 +1,239 @@
+from itertools import repeat
+import numpy as np
+import struct
+import json
+import mmap
+import os
+
+magic = b"TWMAP001"
+suffix = ".map"
+
+
+def narrowest(values):
+    for dtype in (np.int16, np.int32):
+        info = np.iinfo(dtype)
+        if not len(values) or (values.min() >= info.min and values.max() <= info.max):
+            return dtype
+
+    return np.int64
+
+
+def write_table(directory, table, world, frame, generation):
+    """stores a frame as column blocks plus a newline separated string table, swapped in atomically
+
+    names stay url encoded like in the database, so they never contain newlines
+    """
+    blocks, header = [], {'table': table, 'world': world, 'generation': generation,
+                          'rows': len(frame), 'order': list(frame.columns), 'columns': {}, 'strings': {}}
+    position = 0
+
+    def append(data):
+        nonlocal position
+        start = position
+        blocks.append(data)
+        position += len(data)
+
+        # every block starts 8 byte aligned
+        padding = -position % 8
+        blocks.append(b"\0" * padding)
+        position += padding
+        return start
+
+    for column in frame.columns:
+        if column in frame.strings:
+            encoded = [value.encode() for value in frame.strings[column].tolist()]
+            offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+            np.cumsum([len(value) + 1 for value in encoded], out=offsets[1:])
+
+            start = append(offsets.tobytes())
+            header['strings'][column] = [start, append(b"\n".join(encoded))]
+        else:
+            values = frame.column(column)
+            dtype = narrowest(values)
+            header['columns'][column] = [append(values.astype(dtype).tobytes()), np.dtype(dtype).str]
+
+    encoded_header = json.dumps(header).encode()
+    prefix = magic + struct.pack("<I", len(encoded_header)) + encoded_header
+    prefix += b"\0" * (-len(prefix) % 8)
+
+    path = os.path.join(directory, f"{table}_{world}{suffix}")
+    temp_path = f"{path}.{os.getpid()}.tmp"
+
+    with open(temp_path, "wb") as file:
+        file.write(prefix)
+        file.writelines(blocks)
+
+    # readers keep their mapping of the old inode until they reload
+    os.replace(temp_path, path)
+    return path
+
+
+def remove_world(directory, world):
+    for name in os.listdir(directory):
+        if name.endswith(f"_{world}{suffix}"):
+            os.remove(os.path.join(directory, name))
+
+
+class MappedTable:
+    """one table of one world mapped read only, numeric columns are zero copy views"""
+
+    def __init__(self, path):
+        with open(path, "rb") as file:
+            self.inode = os.fstat(file.fileno()).st_ino
+            self.buffer = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if self.buffer[:8] != magic:
+            raise ValueError(f"{path} is no mapped table")
+
+        size = struct.unpack_from("<I", self.buffer, 8)[0]
+        header = json.loads(self.buffer[12:12 + size])
+        base = 12 + size + (-(12 + size) % 8)
+
+        self.table = header['table']
+        self.world = header['world']
+        self.generation = header['generation']
+        self.order = header['order']
+        self.rows = header['rows']
+
+        self.columns = {}
+        for column, (offset, dtype) in header['columns'].items():
+            self.columns[column] = np.frombuffer(self.buffer, dtype=dtype, count=self.rows, offset=base + offset)
+
+        self.strings = {}
+        for column, (offsets, blob) in header['strings'].items():
+            positions = np.frombuffer(self.buffer, dtype=np.int64, count=self.rows + 1, offset=base + offsets)
+            self.strings[column] = (positions, base + blob)
+
+    def __len__(self):
+        return self.rows
+
+    def warm(self):
+        # reads the pages ahead, the first requests after a restart don't fault them in
+        if hasattr(mmap, 'MADV_WILLNEED'):
+            self.buffer.madvise(mmap.MADV_WILLNEED)
+
+    def string(self, column, position):
+        positions, blob = self.strings[column]
+        start, end = positions[position], positions[position + 1] - 1
+        return self.buffer[blob + start:blob + end].decode()
+
+    def string_column(self, column):
+        positions, blob = self.strings[column]
+        if not self.rows:
+            return []
+
+        return self.buffer[blob:blob + positions[-1] - 1].decode().split("\n")
+
+    def find(self, id_):
+        """returns the row of given id like Database.fetchone or None"""
+        ids = self.columns['id']
+        if not -2 ** 63 <= id_ < 2 ** 63:
+            return None
+
+        position = int(np.searchsorted(ids, id_))
+
+        if position == self.rows or ids[position] != id_:
+            return None
+
+        result = {}
+        for column in self.order:
+            if column in self.strings:
+                result[column] = self.string(column, position)
+            else:
+                result[column] = int(self.columns[column][position])
+
+        return result
+
+    def select(self, bounds=None, after=None, limit=None):
+        """positions of the rows within column -> (low, high) bounds and after given id, in id order"""
+        mask = np.ones(self.rows, dtype=bool)
+
+        for column, (low, high) in (bounds or {}).items():
+            values = self.columns[column]
+
+            if low is not None:
+                mask &= values >= low
+
+            if high is not None:
+                mask &= values <= high
+
+        if after is not None:
+            mask[:int(np.searchsorted(self.columns['id'], after, side='right'))] = False
+
+        positions = np.flatnonzero(mask)
+        return positions if limit is None else positions[:limit]
+
+    def values(self, column, positions=None):
+        if column not in self.strings:
+            values = self.columns[column]
+            return (values if positions is None else values[positions]).tolist()
+
+        if positions is None:
+            return self.string_column(column)
+
+        # decoding the whole table pays off for bigger selections
+        if len(positions) > self.rows // 8:
+            strings = self.string_column(column)
+            return [strings[position] for position in positions.tolist()]
+
+        return [self.string(column, position) for position in positions.tolist()]
+
+    def records(self, key='id', columns=None, positions=None):
+        """returns given or all rows like Database.fetch with key, limited to columns if given"""
+        if columns is None:
+            columns = self.order
+
+        columns = [column for column in columns if column != key]
+        keys = self.values(key, positions)
+        values = [self.values(column, positions) for column in columns]
+        rows = zip(*values) if values else repeat(())
+        return {k: dict(zip(columns, row)) for k, row in zip(keys, rows)}
+
+
+class MappedStore:
+    """newest mapped table of every world, swapped as a whole on reload"""
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.tables = {}
+
+    def get(self, table, world):
+        return self.tables.get((table, world))
+
+    def reload(self):
+        tables = {}
+
+        for name in os.listdir(self.directory):
+            if not name.endswith(suffix):
+                continue
+
+            path = os.path.join(self.directory, name)
+            table, world = name[:-len(suffix)].rsplit("_", 1)
+            current = self.tables.get((table, world))
+
+            try:
+                # unchanged files keep their mapping
+                if current is not None and current.inode == os.stat(path).st_ino:
+                    tables[(table, world)] = current
+                else:
+                    tables[(table, world)] = MappedTable(path)
+
+            except (OSError, ValueError) as error:
+                print(f"Mapped Table Error: {error}")
+
+        # requests still holding old tables finish on their mapping
+        self.tables = tables
+        return len(tables)
+
+    def refresh(self, table, world):
+        """maps the newest file of one table, for the update event of a single world"""
+        path = os.path.join(self.directory, f"{table}_{world}{suffix}")
+        current = self.tables.get((table, world))
+
+        if current is not None and current.inode == os.stat(path).st_ino:
+            return current
+
+        tables = self.tables.copy()
+        tables[(table, world)] = MappedTable(path)
+        self.tables = tables
+        return tables[(table, world)]
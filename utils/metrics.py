@@ -0,0 +1,201 @@
+from contextvars import ContextVar
+from bisect import bisect_left
+import time
+
+latency_buckets = (.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+size_buckets = (256, 1024, 4096, 16384, 65536, 262144, 1048576, 4194304, 16777216, 67108864)
+
+registry = []
+
+# database seconds of the current request, filled by utils.Database
+request_db_seconds = ContextVar('request_db_seconds', default=None)
+
+
+def format_labels(names, values, extra=()):
+    pairs = [*zip(names, values), *extra]
+    if not pairs:
+        return ""
+
+    escaped = (f'{name}="{escape_label(value)}"' for name, value in pairs)
+    return "{" + ",".join(escaped) + "}"
+
+
+def escape_label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, documentation, labels=()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        registry.append(self)
+
+    def samples(self):
+        raise NotImplementedError
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for suffix, values, extra, value in self.samples():
+            lines.append(f"{self.name}{suffix}{format_labels(self.labels, values, extra)} {value}")
+
+        return lines
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name, documentation, labels=()):
+        super().__init__(name, documentation, labels)
+        self.values = {}
+
+    def inc(self, *labels, amount=1):
+        self.values[labels] = self.values.get(labels, 0) + amount
+
+    def samples(self):
+        for labels, value in self.values.items():
+            yield "", labels, (), value
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value, *labels):
+        self.values[labels] = value
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labels=(), buckets=latency_buckets):
+        super().__init__(name, documentation, labels)
+        self.buckets = buckets
+        self.series = {}
+
+    def observe(self, value, *labels):
+        series = self.series.get(labels)
+
+        # bucket counts plus +Inf, then the sum
+        if series is None:
+            series = self.series[labels] = [[0] * (len(self.buckets) + 1), 0.]
+
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    def samples(self):
+        for labels, (counts, total) in self.series.items():
+            cumulative = 0
+            for bound, count in zip((*self.buckets, "+Inf"), counts):
+                cumulative += count
+                yield "_bucket", labels, (("le", bound),), cumulative
+
+            yield "_sum", labels, (), round(total, 6)
+            yield "_count", labels, (), cumulative
+
+
+def render():
+    lines = []
+    for metric in registry:
+        lines.extend(metric.render())
+
+    return "\n".join(lines) + "\n"
+
+
+request_seconds = Histogram('api_request_seconds', "request latency per route", ('route',))
+world_request_seconds = Histogram('api_world_request_seconds', "request latency per world", ('world',))
+world_requests = Counter('api_world_requests_total', "requests per route and world", ('route', 'world'))
+response_bytes = Histogram('api_response_bytes', "response body size per route", ('route',), size_buckets)
+request_db = Histogram('api_request_db_seconds', "database seconds per request and route", ('route',))
+request_app = Histogram('api_request_app_seconds', "non database seconds per request and route", ('route',))
+responses = Counter('api_responses_total', "responses per route and status", ('route', 'status'))
+rate_limited = Counter('api_rate_limited_total', "rate limit rejections per route", ('route',))
+warm_seconds = Gauge('api_warm_seconds', "seconds the warm up of the hot worlds took after startup")
+warm_failures = Counter('api_warm_failures_total', "warm up attempts which failed or timed out")
+
+pool_wait = Histogram('db_pool_wait_seconds', "seconds waiting for a pooled connection", ('pool',))
+query_seconds = Histogram('db_query_seconds', "seconds spent inside a query", ('pool', 'method'))
+convert_seconds = Histogram('db_convert_seconds', "seconds converting records to dicts", ('method',))
+pool_connections = Gauge('db_pool_connections', "pooled connections by pool and state", ('pool', 'state'))
+coalesced_queries = Counter('db_coalesced_queries_total', "queries answered by an identical one in flight", ('method',))
+pool_healthy = Gauge('db_pool_healthy', "1 if the last health check of the pool passed", ('pool',))
+mapped_lookups = Counter('api_mapped_lookups_total', "lookups answered by mapped tables or not", ('table', 'result'))
+stream_subscribers = Gauge('api_stream_subscribers', "clients subscribed to update events")
+stream_events = Counter('api_stream_events_total', "update events received per table", ('table',))
+stream_dropped = Counter('api_stream_dropped_total', "update events dropped for slow subscribers")
+
+update_phase_seconds = Gauge('update_phase_seconds', "seconds per phase of the latest update run", ('phase',))
+update_counters = Gauge('update_counter', "counters of the latest update run", ('name',))
+update_duration = Gauge('update_duration_seconds', "duration of the latest update run")
+update_success = Gauge('update_success', "1 if the latest update run succeeded")
+
+
+def observe_call(method, pool, wait, query):
+    # once per database call, callers sharing a coalesced call don't count it again
+    pool_wait.observe(wait, pool)
+    query_seconds.observe(query, pool, method)
+
+
+def observe_query(method, wait, query, convert):
+    convert_seconds.observe(convert, method)
+
+    # every caller waited for the call, so it counts toward each request
+    spent = request_db_seconds.get()
+    if spent is not None:
+        spent[0] += wait + query + convert
+
+
+class MetricsMiddleware:
+    """pure asgi middleware, cheaper than starlette's BaseHTTPMiddleware
+
+    worlds returns the known worlds, every other world path parameter is labeled invalid
+    """
+
+    def __init__(self, app, worlds=None):
+        self.app = app
+        self.worlds = worlds
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != "http":
+            return await self.app(scope, receive, send)
+
+        start = time.perf_counter()
+        response = {'status': 500, 'size': 0}
+        token = request_db_seconds.set([0.])
+
+        async def measured_send(message):
+            if message['type'] == "http.response.start":
+                response['status'] = message['status']
+            elif message['type'] == "http.response.body":
+                response['size'] += len(message.get('body', b""))
+
+            await send(message)
+
+        try:
+            await self.app(scope, receive, measured_send)
+        finally:
+            elapsed = time.perf_counter() - start
+            spent = request_db_seconds.get()[0]
+            request_db_seconds.reset(token)
+
+            # templates instead of raw paths keep the label count bounded
+            route = scope.get('route')
+            path = route.path if route is not None else "unmatched"
+            world = scope.get('path_params', {}).get('world')
+
+            request_seconds.observe(elapsed, path)
+            response_bytes.observe(response['size'], path)
+            request_db.observe(spent, path)
+            request_app.observe(max(elapsed - spent, 0), path)
+            responses.inc(path, response['status'])
+
+            if response['status'] == 429:
+                rate_limited.inc(path)
+
+            if world is not None:
+                if self.worlds is None or world not in self.worlds():
+                    world = "invalid"
+
+                world_request_seconds.observe(elapsed, world)
+                world_requests.inc(path, world)
@@ -1,4 +1,6 @@
 from pydantic import BaseModel
+from typing import List, Tuple, Dict, Optional
+from datetime import datetime
 
 
 class Village(BaseModel):
@@ -45,3 +47,91 @@ class Tribe(BaseModel):
     all_rank: int
     sup_bash: int
     sup_rank: int
+
+
+class PlayerGainer(Player):
+    delta: int
+
+
+class TribeGainer(Tribe):
+    delta: int
+
+
+class Continent(BaseModel):
+    id: int
+    villages: int
+    barbarians: int
+    players: int
+    tribes: int
+    points: int
+
+
+class TribeContinent(BaseModel):
+    tribe_id: int
+    continent: int
+    villages: int
+    points: int
+
+
+class TribeArea(BaseModel):
+    tribe_id: int
+    villages: int
+    points: int
+    min_x: int
+    min_y: int
+    max_x: int
+    max_y: int
+    center_x: float
+    center_y: float
+
+
+class SearchResult(BaseModel):
+    world: str
+    ds_type: str
+    id: int
+    name: str
+    tag: str
+    tribe_id: int
+    member: int
+    villages: int
+    points: int
+    rank: int
+
+
+class UpdateRun(BaseModel):
+    id: int
+    started: datetime
+    duration: float
+    worlds: int
+    success: bool
+    phases: Dict[str, float]
+    counters: Dict[str, int]
+    world_stats: Optional[Dict[str, Dict[str, float]]] = None
+
+
+class IndexUsage(BaseModel):
+    ds_type: str
+    index: str
+    partitions: int
+    size: int
+    scans: int
+    measured: Optional[datetime] = None
+
+
+class TravelRequest(BaseModel):
+    pairs: List[Tuple[int, int]] = []
+    sources: List[int] = []
+    targets: List[int] = []
+    units: List[str] = []
+
+
+class Travel(BaseModel):
+    source: int
+    target: int
+    distance: float
+    duration: Dict[str, int]
+
+
+class TravelResult(BaseModel):
+    units: List[str]
+    results: List[Travel]
@@ -30,6 +30,50 @@ tribe_stats = [
     "all_bash"
 ]
 
+# stats diffed between snapshots for the gainer leaderboards
+gainer_stats = {
+    'player': [
+        "villages",
+        "points",
+        "att_bash",
+        "def_bash",
+        "sup_bash",
+        "all_bash"
+    ],
+    'tribe': [
+        "member",
+        "villages",
+        "points",
+        "all_points",
+        "att_bash",
+        "def_bash",
+        "sup_bash",
+        "all_bash"
+    ]
+}
+
+gainer_periods = (
+    'hour',
+    'day'
+)
+
+# columns of the world list endpoints, every non string one can be filtered
+ds_columns = {
+    'village': ("id", "name", "x", "y", "player_id", "points", "rank"),
+    'player': ("id", "name", "tribe_id", "villages", "points", "rank", "att_bash", "att_rank",
+               "def_bash", "def_rank", "sup_bash", "sup_rank", "all_bash", "all_rank"),
+    'tribe': ("id", "name", "tag", "member", "villages", "points", "all_points", "rank", "att_bash",
+              "att_rank", "def_bash", "def_rank", "all_bash", "all_rank", "sup_bash", "sup_rank")
+}
+
+ds_strings = {
+    'village': ("name",),
+    'player': ("name",),
+    'tribe': ("name", "tag")
+}
+
+max_page_size = 5000
+
 stat_shortcuts = {
     'attack': "att_bash",
     'defense': "def_bash",
@@ -69,12 +113,72 @@ def verify_arguments(**kwargs):
         else:
             changed_arguments.append(real_player_attribute)
 
+    period = kwargs.get('period', 'hour')
+    if period not in gainer_periods:
+        raise error.InvalidArgument('period', period)
+
+    if (gainer_type := kwargs.get('gainer_type')) is not None:
+        for argument in changed_arguments:
+            if argument not in gainer_stats[gainer_type]:
+                raise error.InvalidArgument('attribute', argument)
+
     if len(changed_arguments) == 1:
         return changed_arguments[0]
     else:
         return changed_arguments
 
 
+def verify_fields(ds_type, fields):
+    """returns the requested columns besides id in table order, None for all of them"""
+    if fields is None:
+        return None
+
+    requested = {field.strip() for field in fields.split(",") if field.strip()}
+
+    for field in requested:
+        if field not in ds_columns[ds_type]:
+            raise error.InvalidArgument('fields', field)
+
+    return [column for column in ds_columns[ds_type] if column in requested and column != "id"]
+
+
+def verify_filters(ds_type, filters):
+    """parses column:value and column:low..high with open ends into column -> (low, high)"""
+    result = {}
+    if not filters:
+        return result
+
+    for entry in filters.split(","):
+        column, _, value = entry.strip().partition(":")
+
+        if column not in ds_columns[ds_type] or column in ds_strings[ds_type]:
+            raise error.InvalidArgument('filters', column)
+
+        low, dots, high = value.partition("..")
+
+        try:
+            low = int(low) if low else None
+            high = (int(high) if high else None) if dots else low
+        except ValueError:
+            raise error.InvalidArgument('filters', entry)
+
+        bounds = [bound for bound in (low, high) if bound is not None]
+        if not bounds or not all(-2 ** 63 <= bound < 2 ** 63 for bound in bounds):
+            raise error.InvalidArgument('filters', entry)
+
+        result[column] = (low, high)
+
+    return result
+
+
+def verify_page(after, limit):
+    if after is not None and not -2 ** 63 <= after < 2 ** 63:
+        raise error.InvalidArgument('after', after)
+
+    if limit is not None and not 0 < limit <= max_page_size:
+        raise error.InvalidArgument('limit', limit)
+
+
 def parse_result(data, *keys, iterable=False):
     if data is None:
         return data
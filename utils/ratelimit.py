@@ -0,0 +1,148 @@
+from limits.storage import Storage
+from urllib.parse import urlsplit, parse_qs
+import tempfile
+import hashlib
+import struct
+import fcntl
+import mmap
+import time
+import os
+
+# key hash, hits and expiry timestamp of one fixed window
+slot = struct.Struct("<Qqd")
+
+shared_directory = "/dev/shm" if os.path.isdir("/dev/shm") else tempfile.gettempdir()
+default_limiter_storage = f"shm://{os.path.join(shared_directory, 'tw-connect-limits')}"
+
+
+class SharedMemoryStorage(Storage):
+    """fixed window counters in a memory mapped hash table, shared by every worker on the host
+
+    shm:///dev/shm/name?slots=65536 works as storage uri of slowapi and limits
+    """
+    STORAGE_SCHEME = ["shm"]
+
+    # slots looked at before the one expiring first gets evicted
+    probes = 16
+
+    def __init__(self, uri, **options):
+        super().__init__(uri, **options)
+        parsed = urlsplit(uri)
+        self.path = parsed.path
+        self.slots = int(parse_qs(parsed.query).get('slots', ["65536"])[0])
+        self.pid = None
+        self.file = None
+        self.buffer = None
+        self.open()
+
+    @property
+    def base_exceptions(self):
+        return OSError
+
+    def open(self):
+        # locks belong to the open file, a forked worker needs its own
+        self.pid = os.getpid()
+        self.file = open(self.path, "a+b")
+        size = self.slots * slot.size
+
+        with self.locked():
+            if os.fstat(self.file.fileno()).st_size < size:
+                self.file.truncate(size)
+
+        self.buffer = mmap.mmap(self.file.fileno(), size)
+
+    def locked(self):
+        if self.pid != os.getpid():
+            self.open()
+
+        return FileLock(self.file)
+
+    @staticmethod
+    def hash(key):
+        value = int.from_bytes(hashlib.blake2b(key.encode(), digest_size=8).digest(), "little")
+        return value or 1
+
+    def find(self, hashed, now):
+        """returns the offset of the slot of given hash, a free one or the one expiring first"""
+        start = hashed % self.slots
+        candidate, earliest = None, None
+
+        for probe in range(self.probes):
+            offset = (start + probe) % self.slots * slot.size
+            key, _, expiry = slot.unpack_from(self.buffer, offset)
+
+            if key == hashed:
+                return offset
+
+            if candidate is None and (key == 0 or expiry <= now):
+                candidate = offset
+
+            elif earliest is None or expiry < earliest[1]:
+                earliest = offset, expiry
+
+        return candidate if candidate is not None else earliest[0]
+
+    def incr(self, key, expiry, elastic_expiry=False, amount=1):
+        hashed, now = self.hash(key), time.time()
+
+        with self.locked():
+            offset = self.find(hashed, now)
+            current, hits, expires = slot.unpack_from(self.buffer, offset)
+
+            if current != hashed or expires <= now:
+                hits, expires = 0, now + expiry
+            elif elastic_expiry:
+                expires = now + expiry
+
+            hits += amount
+            slot.pack_into(self.buffer, offset, hashed, hits, expires)
+
+        return hits
+
+    def lookup(self, key):
+        hashed, now = self.hash(key), time.time()
+
+        with self.locked():
+            offset = self.find(hashed, now)
+            current, hits, expires = slot.unpack_from(self.buffer, offset)
+
+        if current != hashed or expires <= now:
+            return 0, now
+
+        return hits, expires
+
+    def get(self, key):
+        return self.lookup(key)[0]
+
+    def get_expiry(self, key):
+        return self.lookup(key)[1]
+
+    def check(self):
+        return self.buffer is not None
+
+    def reset(self):
+        with self.locked():
+            self.buffer[:] = bytes(len(self.buffer))
+
+        return self.slots
+
+    def clear(self, key):
+        hashed = self.hash(key)
+
+        with self.locked():
+            offset = self.find(hashed, time.time())
+            if slot.unpack_from(self.buffer, offset)[0] == hashed:
+                slot.pack_into(self.buffer, offset, 0, 0, 0.)
+
+
+class FileLock:
+    __slots__ = ('file',)
+
+    def __init__(self, file):
+        self.file = file
+
+    def __enter__(self):
+        fcntl.flock(self.file, fcntl.LOCK_EX)
+
+    def __exit__(self, *args):
+        fcntl.flock(self.file, fcntl.LOCK_UN)
@@ -0,0 +1,60 @@
+from collections import Counter, defaultdict
+from contextlib import contextmanager
+import threading
+import datetime
+import json
+import time
+
+
+class RunStats:
+    """seconds per phase and counters of one update run, in total and per world"""
+
+    def __init__(self):
+        self.started = datetime.datetime.now()
+        self.phases = Counter()
+        self.counters = Counter()
+        self.worlds = defaultdict(Counter)
+        # world discovery counts from several threads
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def phase(self, name, world=None):
+        start = time.perf_counter()
+
+        try:
+            yield
+        finally:
+            seconds = time.perf_counter() - start
+
+            with self.lock:
+                self.phases[name] += seconds
+
+                if world is not None:
+                    self.worlds[world][name] += seconds
+
+    def count(self, name, amount=1, world=None):
+        with self.lock:
+            self.counters[name] += amount
+
+            if world is not None:
+                self.worlds[world][name] += amount
+
+    def slowest(self, amount=3):
+        timed = {world: sum(stats[phase] for phase in self.phases) for world, stats in self.worlds.items()}
+        return sorted(timed.items(), key=lambda item: item[1], reverse=True)[:amount]
+
+    def summary(self):
+        phases = " ".join(f"{name}={seconds:.1f}s" for name, seconds in self.phases.most_common())
+        worlds = " ".join(f"{world}={seconds:.1f}s" for world, seconds in self.slowest())
+        return f"phases: {phases} | slowest: {worlds}"
+
+    def record(self, cursor, success):
+        duration = (datetime.datetime.now() - self.started).total_seconds()
+        phases = {name: round(seconds, 3) for name, seconds in self.phases.items()}
+        worlds = {world: {k: round(v, 3) for k, v in stats.items()} for world, stats in self.worlds.items()}
+
+        query = 'INSERT INTO update_run (started, duration, worlds, success, phases, counters, world_stats) ' \
+                'VALUES (%s, %s, %s, %s, %s, %s, %s)'
+        batch = [self.started, duration, len(self.worlds), success,
+                 json.dumps(phases), json.dumps(self.counters), json.dumps(worlds)]
+        cursor.execute(query, batch)
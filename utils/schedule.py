@@ -0,0 +1,131 @@
+import datetime
+import math
+
+
+class Scheduler:
+    """update interval of every world from its change rate and api demand, within a budget of fetches per hour
+
+    refresh rates are proportional to the square root of change times demand,
+    which keeps the demand weighted staleness lowest for a fixed budget
+    """
+
+    def __init__(self, fetches, budget=None, tick=15, shortest=15, longest=360, smoothing=.3):
+        # map files downloaded by one update of a world
+        self.fetches = fetches
+        # fetches per hour, None spends as much as updating every world hourly
+        self.budget = budget
+        self.tick = tick
+        self.shortest = shortest
+        self.longest = longest
+        self.smoothing = smoothing
+
+    def floor(self, date):
+        minutes = date.hour * 60 + date.minute
+        return date.replace(hour=0, minute=0, second=0, microsecond=0) + \
+            datetime.timedelta(minutes=minutes - minutes % self.tick)
+
+    def first_tick(self, cycle):
+        return cycle.minute < self.tick
+
+    def round(self, minutes, longest):
+        # rounding up keeps the rounded intervals within the budget
+        ticks = math.ceil(minutes / self.tick - 1e-9)
+        return min(max(ticks * self.tick, self.shortest), longest)
+
+    def priorities(self, worlds, changes, requests):
+        average = sum(requests.get(world, 0) for world in worlds) / max(len(worlds), 1)
+        result = {}
+
+        for world in worlds:
+            # unknown worlds count as busy until their first observation
+            change = changes.get(world)
+            change = 1. if change is None else change
+            result[world] = (change + .01) * (1 + requests.get(world, 0) / (average + 1))
+
+        return result
+
+    def intervals(self, priorities):
+        """minutes between two updates of every world"""
+        count = len(priorities)
+        if not count:
+            return {}
+
+        updates = count if self.budget is None else self.budget / self.fetches
+
+        # every world gets updated at least every longest minutes, even over budget
+        longest = max(self.longest, self.round(60 * count / updates, math.inf))
+        lowest, highest = 60 / longest, 60 / self.shortest
+
+        free = {world: math.sqrt(priority) for world, priority in priorities.items()}
+        rates = {}
+        remaining = updates
+
+        # water filling, worlds hitting a bound hand their share to the others
+        while free:
+            total = sum(free.values())
+            shares = {world: remaining * weight / total for world, weight in free.items()}
+            bounded = {world: min(max(rate, lowest), highest) for world, rate in shares.items()
+                       if not lowest <= rate <= highest}
+
+            if not bounded:
+                rates.update(shares)
+                break
+
+            for world, rate in bounded.items():
+                rates[world] = rate
+                remaining -= rate
+                del free[world]
+
+            remaining = max(remaining, 0)
+
+        return {world: self.round(60 / max(rate, 1e-9), longest) for world, rate in rates.items()}
+
+    def plan(self, cursor, worlds, cycle):
+        """stores the intervals of the given worlds and returns the ones due this cycle, busiest first"""
+        cursor.execute('SELECT world, minutes, updated, change FROM world_schedule')
+        schedule = {row[0]: row[1:] for row in cursor.fetchall()}
+
+        cursor.execute('SELECT world, sum(requests) / 24. FROM world_demand '
+                       'WHERE hour > %s - interval \'1 day\' GROUP BY world', (cycle,))
+        requests = {world: float(amount) for world, amount in cursor.fetchall()}
+
+        changes = {world: state[2] for world, state in schedule.items()}
+        priorities = self.priorities(worlds, changes, requests)
+        intervals = self.intervals(priorities)
+
+        due, batch = [], []
+        for world in worlds:
+            _, updated, _ = schedule.get(world, (None, None, None))
+            minutes = intervals[world]
+
+            # new intervals apply right away, a world turning busy doesn't wait out its old one
+            if updated is None or updated + datetime.timedelta(minutes=minutes) <= cycle:
+                due.append(world)
+
+            batch.append((world, minutes, requests.get(world, 0.)))
+
+        query = 'INSERT INTO world_schedule (world, minutes, demand) VALUES (%s, %s, %s) ' \
+                'ON CONFLICT (world) DO UPDATE SET minutes = EXCLUDED.minutes, demand = EXCLUDED.demand'
+        cursor.executemany(query, batch)
+
+        cursor.execute('UPDATE world_schedule SET previous = updated, updated = %s WHERE world = ANY(%s)',
+                       (cycle, due))
+        cursor.execute('DELETE FROM world_demand WHERE hour < %s - interval \'2 days\'', (cycle,))
+
+        return sorted(due, key=priorities.get, reverse=True)
+
+    def revert(self, cursor, worlds, cycle):
+        """worlds of a failed run are due again instead of waiting out their interval"""
+        cursor.execute('UPDATE world_schedule SET updated = previous WHERE world = ANY(%s) AND updated = %s',
+                       (list(worlds), cycle))
+
+    def previous(self, cursor, world):
+        """cycle of the update before the current one"""
+        cursor.execute('SELECT previous FROM world_schedule WHERE world = %s', (world,))
+        row = cursor.fetchone()
+        return None if row is None else row[0]
+
+    def observe(self, cursor, world, change):
+        # share of changed entities per hour, smoothed over the last updates
+        query = 'UPDATE world_schedule SET change = COALESCE(change * %s + %s, %s) WHERE world = %s'
+        cursor.execute(query, (1 - self.smoothing, change * self.smoothing, change, world))
@@ -0,0 +1,84 @@
+from contextlib import contextmanager
+import asyncio
+import json
+import utils
+
+
+class Broadcaster:
+    """fans the update events of the updater out to every subscribed client
+
+    each subscriber is one bounded queue, idle ones cost nothing but their socket
+    """
+
+    def __init__(self, backlog=32):
+        self.backlog = backlog
+        # world -> queues, None holds the subscribers of every world
+        self.subscribers = {}
+        # (world, table) -> newest event, replayed to new subscribers
+        self.latest = {}
+        self.sequence = 0
+
+    def __len__(self):
+        return sum(len(queues) for queues in self.subscribers.values())
+
+    def publish(self, event):
+        self.sequence += 1
+        event['id'] = self.sequence
+        self.latest[(event['world'], event['table'])] = event
+
+        for key in (event['world'], None):
+            for queue in self.subscribers.get(key, ()):
+                # slow clients lose their oldest events instead of stalling everyone
+                if queue.full():
+                    queue.get_nowait()
+                    utils.metrics.stream_dropped.inc()
+
+                queue.put_nowait(event)
+
+    def current(self, worlds=None):
+        events = [event for (world, _), event in self.latest.items() if worlds is None or world in worlds]
+        return sorted(events, key=lambda event: event['id'])
+
+    def forget(self, world):
+        for key in [key for key in self.latest if key[0] == world]:
+            del self.latest[key]
+
+    @contextmanager
+    def subscribe(self, worlds=None):
+        """queue receiving the events of given worlds or of all of them"""
+        queue = asyncio.Queue(self.backlog)
+        keys = [None] if worlds is None else list(worlds)
+
+        for key in keys:
+            self.subscribers.setdefault(key, set()).add(queue)
+
+        utils.metrics.stream_subscribers.set(len(self))
+
+        try:
+            yield queue
+        finally:
+            for key in keys:
+                queues = self.subscribers.get(key)
+                queues.discard(queue)
+
+                if not queues:
+                    del self.subscribers[key]
+
+            utils.metrics.stream_subscribers.set(len(self))
+
+
+def parse_event(payload):
+    """returns the event of an update notification or None if it is malformed"""
+    try:
+        event = json.loads(payload)
+    except ValueError:
+        return None
+
+    if not isinstance(event, dict) or not {'world', 'table', 'version'} <= event.keys():
+        return None
+
+    return event
+
+
+def format_event(event):
+    return f"id: {event['id']}\nevent: updated\ndata: {json.dumps(event)}\n\n"
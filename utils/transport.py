@@ -0,0 +1,32 @@
+import threading
+import requests
+
+
+class HttpTransport:
+    """default transport of the updater, anything with get(url) and reset() can replace it
+
+    every thread gets its own session, a reset after an error never cuts off another thread
+    """
+
+    def __init__(self, timeout=60):
+        self.timeout = timeout
+        self.local = threading.local()
+
+    @property
+    def session(self):
+        session = getattr(self.local, 'session', None)
+
+        if session is None:
+            session = self.local.session = requests.Session()
+
+        return session
+
+    def get(self, url):
+        return self.session.get(url, timeout=self.timeout)
+
+    def reset(self):
+        session = getattr(self.local, 'session', None)
+        self.local.session = None
+
+        if session is not None:
+            session.close()
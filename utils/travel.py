@@ -0,0 +1,56 @@
+from utils import error
+
+# minutes per field on speed 1 worlds
+unit_speeds = {
+    'spear': 18,
+    'sword': 22,
+    'axe': 18,
+    'archer': 18,
+    'spy': 9,
+    'light': 10,
+    'marcher': 10,
+    'heavy': 11,
+    'ram': 30,
+    'catapult': 30,
+    'knight': 10,
+    'snob': 35
+}
+
+# units which only exist if the world config enables them
+optional_units = {
+    'archer': "archer",
+    'marcher': "archer",
+    'knight': "knight"
+}
+
+max_travel_pairs = 10000
+
+
+def available_units(config):
+    game = config.get('game', {})
+    return [unit for unit in unit_speeds if str(game.get(optional_units.get(unit), 1)) != "0"]
+
+
+def verify_travel(units, pair_count, config):
+    if not 0 < pair_count <= max_travel_pairs:
+        raise error.InvalidArgument('pairs', pair_count)
+
+    usable = available_units(config)
+    for unit in units:
+        if unit not in usable:
+            raise error.InvalidArgument('unit', unit)
+
+    return units or usable
+
+
+def travel_times(sources, targets, speed, unit_speed, units):
+    """returns distances and travel seconds per unit of (x, y) coordinate pairs"""
+    # loaded with the first travel request instead of with every worker
+    import numpy as np
+
+    delta = np.asarray(sources, dtype=np.float64) - np.asarray(targets, dtype=np.float64)
+    distances = np.hypot(delta[:, 0], delta[:, 1])
+
+    seconds_per_field = np.array([unit_speeds[unit] for unit in units]) * 60 / (speed * unit_speed)
+    durations = np.rint(np.outer(distances, seconds_per_field)).astype(np.int64)
+    return np.round(distances, 2), durations
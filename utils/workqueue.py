@@ -0,0 +1,135 @@
+class Job:
+    __slots__ = ('cycle', 'world', 'ds_type', 'attempts')
+
+    def __init__(self, cycle, world, ds_type, attempts):
+        self.cycle = cycle
+        self.world = world
+        self.ds_type = ds_type
+        self.attempts = attempts
+
+    def __repr__(self):
+        return f"<Job {self.cycle:%H:%M} {self.ds_type} {self.world or '-'}>"
+
+
+class WorkQueue:
+    """update cycles split into leased jobs, shared by any number of workers"""
+
+    # world discovery first, tribes and villages need the players of their world
+    steps = ("world", "player", "tribe", "village")
+
+    def __init__(self, conn, worker, lease_seconds=900, max_attempts=3):
+        self.conn = conn
+        self.worker = worker
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+
+    def now(self):
+        """clock of the database, shared by every worker unlike their own"""
+        cur = self.conn.cursor()
+        cur.execute('SELECT now()::timestamp;')
+        now = cur.fetchone()[0]
+        self.conn.commit()
+        return now
+
+    def start(self, cycle):
+        """opens the given cycle once, returns it and whether this call opened it"""
+        cur = self.conn.cursor()
+        cur.execute('INSERT INTO update_cycle (cycle, started) VALUES (%s, now()) '
+                    'ON CONFLICT (cycle) DO NOTHING RETURNING cycle;', (cycle,))
+        opened = cur.fetchone() is not None
+
+        if opened:
+            # older cycles are given up instead of racing the new one
+            cur.execute('UPDATE update_job SET state = \'failed\', worker = NULL, leased_until = NULL '
+                        'WHERE cycle < %s AND state IN (\'pending\', \'leased\');', (cycle,))
+            cur.execute('UPDATE update_cycle SET finished = now(), success = false '
+                        'WHERE cycle < %s AND finished IS NULL;', (cycle,))
+            cur.execute('INSERT INTO update_job (cycle, world, ds_type, step) VALUES (%s, \'\', \'world\', 0);',
+                        (cycle,))
+
+        self.conn.commit()
+        return cycle, opened
+
+    def enqueue(self, cycle, worlds):
+        cur = self.conn.cursor()
+        batch = [(cycle, world, ds_type, step) for world in worlds for step, ds_type in enumerate(self.steps) if step]
+        cur.executemany('INSERT INTO update_job (cycle, world, ds_type, step) VALUES (%s, %s, %s, %s) '
+                        'ON CONFLICT (cycle, world, ds_type) DO NOTHING;', batch)
+
+    def reclaim(self):
+        """frees expired leases of crashed or stuck workers"""
+        cur = self.conn.cursor()
+        cur.execute('UPDATE update_job SET state = CASE WHEN attempts >= %s THEN \'failed\' ELSE \'pending\' END, '
+                    'worker = NULL, leased_until = NULL WHERE state = \'leased\' AND leased_until < now();',
+                    (self.max_attempts,))
+        self.conn.commit()
+        return cur.rowcount
+
+    def lease(self):
+        cur = self.conn.cursor()
+        query = 'UPDATE update_job SET state = \'leased\', worker = %s, attempts = attempts + 1, ' \
+                'leased_until = now() + %s * interval \'1 second\' ' \
+                'WHERE (cycle, world, ds_type) = (' \
+                'SELECT cycle, world, ds_type FROM update_job job WHERE state = \'pending\' ' \
+                'AND (step < 2 OR EXISTS (SELECT 1 FROM update_job player WHERE player.cycle = job.cycle ' \
+                'AND player.world = job.world AND player.ds_type = \'player\' ' \
+                'AND player.state IN (\'done\', \'failed\'))) ' \
+                'ORDER BY cycle, step, world LIMIT 1 FOR UPDATE SKIP LOCKED) ' \
+                'RETURNING cycle, world, ds_type, attempts;'
+
+        cur.execute(query, (self.worker, self.lease_seconds))
+        row = cur.fetchone()
+        self.conn.commit()
+        return Job(*row) if row else None
+
+    def complete(self, job):
+        """marks the job done inside the transaction that stored its data, False if the lease was lost"""
+        cur = self.conn.cursor()
+        cur.execute('UPDATE update_job SET state = \'done\', leased_until = NULL '
+                    'WHERE cycle = %s AND world = %s AND ds_type = %s AND worker = %s '
+                    'AND state = \'leased\' AND attempts = %s;',
+                    (job.cycle, job.world, job.ds_type, self.worker, job.attempts))
+        return cur.rowcount == 1
+
+    def fail(self, job):
+        cur = self.conn.cursor()
+        state = "failed" if job.attempts >= self.max_attempts else "pending"
+        cur.execute('UPDATE update_job SET state = %s, worker = NULL, leased_until = NULL '
+                    'WHERE cycle = %s AND world = %s AND ds_type = %s AND worker = %s;',
+                    (state, job.cycle, job.world, job.ds_type, self.worker))
+        self.conn.commit()
+        return state
+
+    def reschedule_failed(self, cursor):
+        """worlds whose last scheduled update failed, or got given up with its cycle, become due again"""
+        cursor.execute('UPDATE world_schedule s SET updated = s.previous FROM update_job job '
+                       'WHERE job.cycle = s.updated AND job.world = s.world AND job.state = \'failed\';')
+        return cursor.rowcount
+
+    def pending(self, cycle):
+        cur = self.conn.cursor()
+        cur.execute('SELECT count(*) FROM update_job WHERE cycle = %s AND state IN (\'pending\', \'leased\');',
+                    (cycle,))
+        count = cur.fetchone()[0]
+        self.conn.commit()
+        return count
+
+    def finish(self, cycle):
+        """completion barrier, returns the success of the cycle to exactly one worker, None to the rest
+
+        called after the job commit, so the last worker always sees every other job ended
+        """
+        cur = self.conn.cursor()
+        cur.execute('UPDATE update_cycle SET finished = now(), success = NOT EXISTS ('
+                    'SELECT 1 FROM update_job WHERE cycle = %s AND state = \'failed\') '
+                    'WHERE cycle = %s AND finished IS NULL AND NOT EXISTS ('
+                    'SELECT 1 FROM update_job WHERE cycle = %s AND state IN (\'pending\', \'leased\')) '
+                    'RETURNING success;', (cycle, cycle, cycle))
+        row = cur.fetchone()
+        return None if row is None else row[0]
+
+    def cleanup(self, days):
+        cur = self.conn.cursor()
+        cur.execute('DELETE FROM update_job WHERE cycle < now() - %s * interval \'1 day\';', (days,))
+        cur.execute('DELETE FROM update_cycle WHERE cycle < now() - %s * interval \'1 day\';', (days,))
+